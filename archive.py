@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       archive.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""Reading the files of a game from its SAR, NSA and NS2 archives, so
+it doesn't have to be extracted.
+
+An archive is mapped into memory and its directory read once, into an
+index by lowercase name with "/" between directories, like the paths
+localize_path makes. Entries are read straight from the mapping, or
+decompressed when they're first read; the game's ArchiveSet keeps the
+ones decompressed last."""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import re
+import mmap
+import struct
+import threading
+import collections
+
+import pool
+import compression
+
+
+# how an NSA entry is stored
+NONE, SPB, LZSS, NBZ = 0, 1, 2, 4
+
+DECODERS = { SPB: compression.decode_spb,
+             LZSS: compression.decode_lzss,
+             NBZ: compression.decode_nbz }
+             
+# where an entry is in its archive; length is what's stored,
+# original_length what it's stored from
+Entry = collections.namedtuple( "Entry", "offset length original_length compression" )
+
+# the archives of a game, in the order they're searched: arc.sar, then
+# arc.nsa, arc1.nsa ... arc9.nsa, then 00.ns2 ... 99.ns2; the entries of
+# later ones replace the ones of earlier ones, like patches do
+ARCHIVE_NAMES = re.compile( r"^(?:arc\.sar|arc(\d?)\.nsa|(\d\d)\.ns2)$" )
+
+
+def normalized(name):
+    """The index key of a file name, in an archive or not."""
+    
+    return name.replace("\\", "/").replace(os.sep, "/").lower()
+    
+    
+class Archive(object):
+    """One archive file."""
+    
+    def __init__(self, path):
+        self.path = path
+        # name -> Entry
+        self.entries = {}
+        
+        with open(path, "rb") as f:
+            self._mapped = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+            
+        self._stamp = os.path.getmtime(path)
+        
+        kind = os.path.splitext(path)[1].lower()
+        if kind == ".ns2":
+            self._read_ns2()
+            
+        else:
+            self._read_sar_nsa( has_compression=(kind == ".nsa") )
+            
+            
+    def _read_sar_nsa(self, has_compression):
+        # big endian; a count and the start of the data, then names with
+        # (compression,) offset and length (, original length)
+        data = self._mapped
+        count, base = struct.unpack_from(b">HI", data)
+        
+        fields = struct.Struct(b">BIII" if has_compression else b">II")
+        position = 6
+        for i in xrange(count):
+            end = data.find(b"\0", position)
+            if end < 0:
+                raise IOError("Broken archive directory: " + self.path)
+                
+            name = data[position:end]
+            position = end+1
+            
+            if has_compression:
+                compression, offset, length, original_length = fields.unpack_from(data, position)
+                
+            else:
+                offset, length = fields.unpack_from(data, position)
+                compression, original_length = NONE, length
+                
+            position += fields.size
+            self._add( name, Entry(base+offset, length, original_length, compression) )
+            
+            
+    def _read_ns2(self):
+        # little endian; the start of the data, then quoted names with
+        # their lengths, the data being in the same order
+        data = self._mapped
+        base, = struct.unpack_from(b"<I", data)
+        
+        position = 4
+        offset = base
+        while position < base and data[position] == b'"':
+            end = data.find(b'"', position+1)
+            if end < 0:
+                raise IOError("Broken archive directory: " + self.path)
+                
+            name = data[position+1:end]
+            length, = struct.unpack_from(b"<I", data, end+1)
+            position = end+5
+            
+            self._add( name, Entry(offset, length, length, NONE) )
+            offset += length
+            
+            
+    def _add(self, name, entry):
+        # the names are in Shift JIS
+        name = normalized( name.decode("cp932", "replace") )
+        self.entries[name] = entry
+        
+        
+    def __contains__(self, name):
+        return name in self.entries
+        
+        
+    def view(self, name):
+        """The stored bytes of an entry, without copying them."""
+        
+        entry = self.entries[name]
+        return buffer(self._mapped, entry.offset, entry.length)
+        
+        
+    def open(self, name, decompress=None):
+        """A file object reading an entry, for the loaders that take
+        files. A compressed one is decompressed when it's first read,
+        by decompress(name) if it's given."""
+        
+        entry = self.entries[name]
+        stamp = (self.path, self._stamp, entry.offset)
+        if entry.compression == NONE:
+            return EntryFile( self._mapped, entry.offset, entry.length, name, stamp )
+            
+        decompress = decompress or self.decompress
+        return EntryFile( lambda: decompress(name), 0, self.decompressed_length(name),
+                          name, stamp, self.view(name) )
+                          
+                          
+    def decompressed_length(self, name):
+        entry = self.entries[name]
+        if entry.compression == SPB:
+            return compression.spb_size( self.view(name) )
+            
+        elif entry.compression == NBZ:
+            return compression.nbz_size( self.view(name) )
+            
+        return entry.original_length
+        
+        
+    def decompress(self, name):
+        entry = self.entries[name]
+        decode = DECODERS.get(entry.compression)
+        if decode == None:
+            raise IOError( "Unknown compression {0} of archive entry {1}".format(entry.compression, name) )
+            
+        out = bytearray( self.decompressed_length(name) )
+        decode( self.view(name), out )
+        return out
+                          
+                          
+    def close(self):
+        self._mapped.close()
+        
+        
+class EntryFile(object):
+    """A read only file of part of a mapping or a buffer. stamp changes
+    when what's in it might, and stored is what's in the archive, for
+    telling files apart without decompressing them.
+    
+    data can also be a function giving it, called when the file is first
+    read."""
+    
+    def __init__(self, data, offset, length, name, stamp, stored=None):
+        self._data = data
+        self._start = offset
+        self._end = offset+length
+        self._position = offset
+        self.name = name
+        self.stamp = stamp
+        self.stored = stored if stored != None else self.view()
+        
+        
+    def _contents(self):
+        if callable(self._data):
+            self._data = self._data()
+            
+        return self._data
+        
+        
+    def read(self, size=-1):
+        if size < 0:
+            size = self._end-self._position
+            
+        start = self._position
+        self._position = min(start+size, self._end)
+        # the loaders want strings
+        return bytes( buffer(self._contents(), start, self._position-start) )
+        
+        
+    def seek(self, offset, whence=0):
+        base = (self._start, self._position, self._end)[whence]
+        self._position = max( self._start, min(base+offset, self._end) )
+        
+        
+    def tell(self):
+        return self._position-self._start
+        
+        
+    def view(self):
+        """The whole file, without copying it."""
+        
+        return buffer(self._contents(), self._start, self._end-self._start)
+        
+        
+    def close(self):
+        pass
+        
+        
+class ArchiveSet(object):
+    """All the archives of a game in directory. The entries decompressed
+    last are kept, cache_bytes of them; None keeps them all."""
+    
+    def __init__(self, directory, cache_bytes=None):
+        found = []
+        for name in os.listdir(directory):
+            match = ARCHIVE_NAMES.match( name.lower() )
+            if not match:
+                continue
+                
+            nsa_number, ns2_number = match.groups()
+            if ns2_number != None:
+                order = ( 2, int(ns2_number) )
+                
+            elif name.lower().endswith(".nsa"):
+                order = ( 1, int(nsa_number or 0) )
+                
+            else:
+                order = ( 0, 0 )
+                
+            found.append( (order, os.path.join(directory, name)) )
+            
+        self.archives = [ Archive(path) for order, path in sorted(found) ]
+        
+        # name -> the archive it's read from
+        self._index = {}
+        for archive in self.archives:
+            self._index.update( dict.fromkeys(archive.entries, archive) )
+            
+        # name -> the entry decompressed; entries are decompressed
+        # without the lock and handed to it by _ready
+        self._decompressed = pool.Pool( self._take, budget=cache_bytes, sizer=len )
+        self._ready = {}
+        self._lock = threading.Lock()
+        
+        # name -> the Event of a decompression going on, which
+        # the others reading the same entry wait for
+        self._decompressing = {}
+        
+        
+    def _find(self, name):
+        name = normalized(name)
+        if name not in self._index and name.endswith(".wav"):
+            # sounds are often kept bzipped as .nbz files
+            nbz = name[:-len(".wav")] + ".nbz"
+            if nbz in self._index:
+                return nbz
+                
+        return name
+        
+        
+    def __contains__(self, name):
+        return self._find(name) in self._index
+        
+        
+    def open(self, name):
+        name = self._find(name)
+        return self._index[name].open(name, self._cached)
+        
+        
+    def _cached(self, name):
+        # loaders on other threads decompress different entries at the
+        # same time, and the same one once
+        while True:
+            with self._lock:
+                if name in self._decompressed:
+                    return self._decompressed[name]
+                    
+                decompressing = self._decompressing.get(name)
+                if decompressing == None:
+                    decompressing = self._decompressing[name] = threading.Event()
+                    break
+                    
+            decompressing.wait()
+            # there now, unless it failed; then this thread tries
+            
+        try:
+            data = self._index[name].decompress(name)
+            
+            with self._lock:
+                self._ready[name] = data
+                return self._decompressed[name]
+                
+        finally:
+            with self._lock:
+                del self._decompressing[name]
+                
+            decompressing.set()
+            
+            
+    def _take(self, name):
+        # with the lock held
+        return self._ready.pop(name)
+        
+        
+    def stats(self):
+        with self._lock:
+            return self._decompressed.stats()
+        
+        
+    def close(self):
+        for archive in self.archives:
+            archive.close()
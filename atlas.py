@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       atlas.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""Outlined glyphs rasterized once into shared surfaces.
+
+Every character is rendered by the font twice, in the text color and in
+the outline color, and both are packed into atlas pages. Text is drawn
+by blitting parts of the pages: first every outline a pixel down and
+right, then every glyph over them, like rendering the whole string twice
+would. The pages can be saved, so the next start doesn't have to render
+the same characters again.
+
+All surfaces here have their colors multiplied by their alpha and have
+to be blitted with BLEND_PREMULTIPLIED."""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import json
+
+import pygame
+
+
+PAGE_SIZE = (512, 512)
+INDEX_NAME = "index.json"
+VERSION = 1
+
+
+def premultiplied(surface):
+    """A copy of a per-pixel alpha surface with its colors multiplied by
+    its alpha."""
+    
+    result = surface.copy()
+    
+    alpha = pygame.surfarray.array_alpha(result) / 255
+    rgb = pygame.surfarray.pixels3d(result)
+    for i in xrange(3):
+        rgb[..., i] = ( rgb[..., i]*alpha ).round()
+    del rgb
+    
+    return result
+    
+    
+def unpremultiplied(surface):
+    """The other way around: a copy with straight alpha, for drawing
+    where BLEND_PREMULTIPLIED can't be used."""
+    
+    result = surface.copy()
+    
+    alpha = pygame.surfarray.array_alpha(result)
+    shown = alpha > 0
+    alpha = alpha[shown] / 255
+    rgb = pygame.surfarray.pixels3d(result)
+    for i in xrange(3):
+        channel = rgb[..., i]
+        channel[shown] = ( channel[shown]/alpha ).round().clip(0, 255)
+    del rgb, channel
+    
+    return result
+    
+    
+class GlyphAtlas(object):
+    """The glyphs of one font in one pair of colors.
+    
+    path is the directory the atlas is saved in, or None. stamp
+    identifies the font file; a saved atlas with a different stamp
+    is not used."""
+    
+    def __init__(self, font, color, outline_color, path=None, stamp=None):
+        self.font = font
+        self.colors = {False: color, True: outline_color}
+        self.path = path
+        self.stamp = stamp
+        
+        self.pages = []
+        # (character, outline) -> (page index, Rect, advance)
+        self.glyphs = {}
+        # the free row of the last page: x, y and height
+        self._shelf = (0, 0, 0)
+        self.changed = False
+        
+        if path != None:
+            self.load()
+            
+            
+    def glyph(self, c, outline=False):
+        try:
+            return self.glyphs[(c, outline)]
+            
+        except KeyError:
+            rendered = premultiplied( self.font.render(c, True, self.colors[outline]) )
+            
+            metrics = self.font.metrics(c)
+            if metrics and metrics[0] != None:
+                advance = metrics[0][4]
+                
+            else:
+                # not in the font
+                advance = self.font.size(c)[0]
+                
+            page, rect = self._allocate( rendered.get_size() )
+            self.pages[page].blit( rendered, rect, special_flags=pygame.BLEND_PREMULTIPLIED )
+            
+            self.glyphs[(c, outline)] = (page, rect, advance)
+            self.changed = True
+            return self.glyphs[(c, outline)]
+            
+            
+    def _allocate(self, size):
+        # shelf packing: glyphs are put next to each other in rows
+        width, height = size
+        x, y, row_height = self._shelf
+        
+        if x+width > PAGE_SIZE[0]:
+            x, y, row_height = 0, y+row_height, 0
+            
+        if not self.pages or y+height > PAGE_SIZE[1]:
+            self.pages.append( pygame.Surface(PAGE_SIZE, pygame.SRCALPHA) )
+            x, y, row_height = 0, 0, 0
+            
+        self._shelf = ( x+width, y, max(row_height, height) )
+        return len(self.pages)-1, pygame.Rect( (x, y), size )
+        
+        
+    def render(self, s):
+        """Render s with its outline onto a new surface."""
+        
+        # where the glyphs go, and how much space they need
+        placed = []
+        x = 0
+        width = height = 0
+        for c in s:
+            page, rect, advance = self.glyph(c)
+            placed.append( (c, x) )
+            width = max(width, x+rect.width)
+            height = max(height, rect.height)
+            x += advance
+            
+        result = pygame.Surface( (width+1, height+1), pygame.SRCALPHA )
+        
+        for outline, offset in ( (True, 1), (False, 0) ):
+            for c, x in placed:
+                page, rect, advance = self.glyph(c, outline)
+                result.blit( self.pages[page], (x+offset, offset), rect,
+                             special_flags=pygame.BLEND_PREMULTIPLIED )
+                             
+        return result
+        
+        
+    def load(self):
+        try:
+            with open( os.path.join(self.path, INDEX_NAME) ) as f:
+                index = json.load(f)
+                
+            if index["version"] != VERSION or index["stamp"] != self.stamp:
+                return
+                
+            pages = [ pygame.image.load( os.path.join(self.path, name) )
+                      for name in index["pages"] ]
+                      
+        except (IOError, ValueError, KeyError, pygame.error):
+            # no atlas saved yet, or a broken one
+            return
+            
+        # The pages are loaded as they were saved, premultiplied.
+        # Only the last one is written to from now on, so it's copied.
+        self.pages = pages
+        self.pages[-1] = self.pages[-1].copy()
+        for c, outline, page, x, y, width, height, advance in index["glyphs"]:
+            self.glyphs[(c, outline)] = (page, pygame.Rect(x, y, width, height), advance)
+            
+        self._shelf = tuple(index["shelf"])
+        
+        
+    def save(self):
+        """Write the atlas to its directory, if it has one and changed."""
+        
+        if self.path == None or not self.changed:
+            return
+            
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+            
+        names = []
+        for i, page in enumerate(self.pages):
+            names.append( "page{0}.png".format(i) )
+            pygame.image.save( page, os.path.join(self.path, names[-1]) )
+            
+        glyphs = [ (c, outline, page, rect.x, rect.y, rect.width, rect.height, advance)
+                   for (c, outline), (page, rect, advance) in self.glyphs.iteritems() ]
+                   
+        index = dict(version=VERSION, stamp=self.stamp, pages=names,
+                     shelf=self._shelf, glyphs=glyphs)
+        with open( os.path.join(self.path, INDEX_NAME), "w" ) as f:
+            json.dump(index, f)
+            
+        self.changed = False
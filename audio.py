@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       audio.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""Playing sounds and music without waiting for them to load.
+
+A sound that isn't loaded yet is loaded on a thread, and starts playing
+on its channel from there when it's ready, faded in so starting late
+isn't as noticeable. Whatever is asked of a channel afterwards (another
+sound, or stopping it) wins over a load still going on. Music is loaded
+on a thread of its own, one track after the other, since there's only
+one pygame.mixer.music."""
+
+from __future__ import division, print_function, unicode_literals
+
+import Queue
+import timeit
+import threading
+import multiprocessing.pool
+
+import pygame
+
+
+# the channel of the music
+MUSIC = "music"
+
+
+class AsyncPlayer(object):
+    """Plays on the numbered mixer channels and MUSIC. threads load the
+    sounds, and the ones that were loaded start with a fade in of
+    fade_ms. error is called with what went wrong when a load fails.
+    
+    Only the thread running the script may call the methods here."""
+    
+    def __init__(self, error, threads=2, fade_ms=0):
+        self.error = error
+        self.fade_ms = fade_ms
+        
+        self._sound_workers = multiprocessing.pool.ThreadPool( max(threads, 1) )
+        self._music_worker = multiprocessing.pool.ThreadPool(1)
+        
+        # channel -> what was asked of it last, to tell if a load
+        # finishing is still wanted; None once something played
+        self._requests = {}
+        self._lock = threading.Lock()
+        
+        # name -> the load of a sound still loading, which the
+        # channels asking for it again share
+        self._loading = {}
+        
+        # the (name, sound) loaded, for the caller to keep
+        self._loaded = Queue.Queue()
+        
+        # name -> [loads, seconds, most seconds] from asking to playing
+        self.latencies = {}
+        
+        
+    def play(self, channel, name, load, loops=0):
+        """Play the sound load() gives on channel once it's loaded,
+        loops more times. For MUSIC, load loads pygame.mixer.music."""
+        
+        request = object()
+        with self._lock:
+            self._requests[channel] = request
+            if channel != MUSIC:
+                load = self._loading.setdefault( name, _once(load) )
+                
+        workers = self._music_worker if channel == MUSIC else self._sound_workers
+        workers.apply_async( self._load, (channel, request, name, load, loops,
+                                          timeit.default_timer()) )
+                                          
+                                          
+    def play_now(self, channel, sound, loops=0):
+        # one that's loaded already
+        with self._lock:
+            self._requests[channel] = None
+            pygame.mixer.Channel(channel).play(sound, loops)
+            
+            
+    def _load(self, channel, request, name, load, loops, asked):
+        # on a loading thread
+        try:
+            sound, loaded = load(), True
+            
+        except Exception as e:
+            self.error( "Couldn't load {0}: {1}".format(name, e) )
+            sound, loaded = None, False
+            
+        with self._lock:
+            if channel != MUSIC and self._loading.get(name) is load:
+                # the first of the channels sharing the load
+                del self._loading[name]
+                if loaded:
+                    self._loaded.put( (name, sound) )
+                    
+            if not loaded:
+                return
+                
+            if self._requests.get(channel) is not request:
+                # something else was played or it was stopped
+                return
+                
+            if channel == MUSIC:
+                pygame.mixer.music.play(loops, 0, self.fade_ms)
+                
+            else:
+                pygame.mixer.Channel(channel).play(sound, loops, 0, self.fade_ms)
+                
+            self._requests[channel] = None
+            self._measure( name, timeit.default_timer()-asked )
+            
+            
+    def _measure(self, name, seconds):
+        # with the lock held
+        loads, total, most = self.latencies.get( name, (0, 0, 0) )
+        self.latencies[name] = [ loads+1, total+seconds, max(most, seconds) ]
+        
+        
+    def loaded(self):
+        """The (name, sound) pairs loaded since the last call."""
+        
+        while True:
+            try:
+                yield self._loaded.get_nowait()
+                
+            except Queue.Empty:
+                return
+                
+                
+    def stop(self, channel):
+        with self._lock:
+            self._requests[channel] = None
+            if channel == MUSIC:
+                pygame.mixer.music.stop()
+                
+            else:
+                pygame.mixer.Channel(channel).stop()
+                
+                
+    def stop_all(self):
+        with self._lock:
+            for channel in self._requests:
+                self._requests[channel] = None
+                
+            pygame.mixer.stop()
+            pygame.mixer.music.stop()
+            
+            
+    def stats(self):
+        with self._lock:
+            return dict( (name, list(latency)) for name, latency in self.latencies.iteritems() )
+            
+            
+    def close(self):
+        self._sound_workers.terminate()
+        self._music_worker.terminate()
+        
+        
+def _once(load):
+    # load, but only the first time it's called, which
+    # the other callers wait for; again if it failed
+    lock = threading.Lock()
+    loaded = []
+    
+    def load_once():
+        with lock:
+            if not loaded:
+                loaded.append( load() )
+                
+            return loaded[0]
+            
+    return load_once
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       backlog.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""The text history (lookback) of the pages already read."""
+
+from __future__ import division, print_function, unicode_literals
+
+import array
+import collections
+
+
+# markers in the page arrays
+_BR = -1
+_LITERAL = -2
+
+
+class Backlog(object):
+    """Past pages, kept as positions in the script instead of text.
+    
+    Every page is an array of (line, index) int pairs pointing to the
+    text commands of the script, so a page costs a few bytes per text
+    command. Text that can't be found again in the script (e.g. because
+    it came from a variable) is kept as it was displayed. The text is
+    only looked up when the page is viewed. Every page has a serial
+    number the frontend can cache what it made of it by."""
+    
+    def __init__(self, parser, size=10000):
+        self.parser = parser
+        
+        self.pages = collections.deque(maxlen=size)
+        self._serial = 0
+        self._current = array.array(b"i")
+        self._literals = []
+        
+        
+    def __len__(self):
+        return len(self.pages)
+        
+        
+    def add_text(self, s):
+        # text coming straight from a text command of the script
+        # can be found again from its position
+        if self.parser.last_command == ["text", [s]]:
+            self._current.extend(self.parser.position)
+            
+        else:
+            self._current.extend( (_LITERAL, len(self._literals)) )
+            self._literals.append(s)
+            
+            
+    def add_br(self):
+        self._current.extend( (_BR, 0) )
+        
+        
+    def end_page(self):
+        if len(self._current) == 0:
+            return
+            
+        literals = tuple(self._literals) if self._literals else None
+        self.pages.append( (self._serial, self._current, literals) )
+        self._serial += 1
+        
+        self._current = array.array(b"i")
+        self._literals = []
+        
+        
+    def serial(self, n):
+        """The serial number of the nth page back."""
+        
+        return self.pages[-n-1][0]
+        
+        
+    def page_items(self, n):
+        """The text of the nth page back (0 is the last page) as
+        strings and None for line breaks."""
+        
+        serial, refs, literals = self.pages[-n-1]
+        
+        items = []
+        for i in xrange(0, len(refs), 2):
+            line, index = refs[i], refs[i+1]
+            if line == _BR:
+                items.append(None)
+                
+            elif line == _LITERAL:
+                items.append( literals[index] )
+                
+            else:
+                cmd = self.parser.command_at( (line, index) )
+                # the script might have been reloaded since
+                if cmd != None and cmd[0] == "text":
+                    items.append( cmd[1][0] )
+                    
+        return items
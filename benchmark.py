@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       benchmark.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""Timings of the parts of the pygame frontend that have more than one
+way of doing the same thing. Runs headless with SDL's dummy drivers
+unless SDL_VIDEODRIVER says otherwise."""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import bz2
+import struct
+import random
+import optparse
+import timeit
+import multiprocessing.pool
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+import images
+import sprites
+import compression
+import pynscr_pygame
+
+
+def report(name, seconds, count, unit):
+    print( "{0:<32} {1:>10.3f} ms per {2}".format(name, seconds/count*1000, unit) )
+    
+    
+def report_throughput(name, seconds, size):
+    print( "{0:<32} {1:>10.1f} MB/s".format(name, size/seconds/(1024*1024)) )
+    
+    
+def test_scene(resolution, sprite_count):
+    """A scene with a background, half-transparent sprites and a page
+    of text, like a busy moment of a game."""
+    
+    bg = pygame.Surface(resolution)
+    bg.fill( (40, 60, 90) )
+    
+    image = pygame.Surface( (120, 160), pygame.SRCALPHA )
+    image.fill( (200, 120, 80, 220) )
+    
+    shown = [ sprites.Sprite( image, (i*37 % resolution[0], i*53 % resolution[1]),
+                              alpha=(255 if i % 2 else 128) )
+              for i in xrange(sprite_count) ]
+              
+    text = tuple( ( (20, 20+i*20), "The quick brown fox jumps over the lazy dog {0}".format(i) )
+                  for i in xrange(12) )
+                  
+    return pynscr_pygame.Scene( bg=bg, sprites=tuple(shown), standing_pictures=(), text=text,
+                                page=1, page_chars=sum( len(s) for _, s in text ), shown_chars=0,
+                                text_speed=0, skip_mode=False, backlog=None, caption=None,
+                                dirty_rects=None, scene_rects=None )
+                                
+                                
+def bench_render(options):
+    """Full frames and frames with one sprite moving, with every
+    display backend."""
+    
+    resolution = pynscr_pygame.RESOLUTION
+    pygame.init()
+    
+    backends = [ ("surface", lambda: pynscr_pygame.SceneRenderer(resolution, None)),
+                 ("software", lambda: pynscr_pygame.TextureSceneRenderer(resolution, None, True)) ]
+                 
+    for name, make in backends:
+        try:
+            renderer = make()
+            
+        except (ImportError, pygame.error) as e:
+            print(name, "not available:", e)
+            continue
+            
+        if name == "surface":
+            renderer.set_surface( pygame.display.set_mode(resolution) )
+            
+        renderer.MAX_FPS = 0
+        scene = test_scene(resolution, options.sprites)
+        # the text is rendered once, like it would be on a page
+        renderer.update(scene)
+        
+        start = timeit.default_timer()
+        for i in xrange(options.frames):
+            renderer.update( scene._replace(dirty_rects=None, scene_rects=None) )
+            
+        report(name + ", whole frames", timeit.default_timer()-start, options.frames, "frame")
+        
+        start = timeit.default_timer()
+        for i in xrange(options.frames):
+            old = scene.sprites[0]
+            moved = sprites.Sprite( old.image, (i % resolution[0], old.topleft[1]), alpha=old.alpha )
+            rects = (old.rect, moved.rect)
+            scene = scene._replace( sprites=(moved,)+scene.sprites[1:],
+                                    dirty_rects=rects, scene_rects=rects )
+            renderer.update(scene)
+            
+        report(name + ", a sprite moving", timeit.default_timer()-start, options.frames, "frame")
+        
+        
+def masked_image(size):
+    """A standing picture with its alpha mask, as it would be loaded for
+    ":a": the picture on the left, a gray mask on the right."""
+    
+    width, height = size
+    image = pygame.Surface( (width*2, height), 0, 24 )
+    image.fill( (200, 120, 80), (0, 0, width, height) )
+    for y in xrange(0, height, 4):
+        gray = y*255 // height
+        image.fill( (gray, gray, gray), (width, y, width, 4) )
+        
+    return image
+    
+    
+def packed_alpha_masked(image):
+    # how load_sprite did it before images.alpha_masked,
+    # with the mask and a white surface as packed pixels
+    x, y = image.get_size()
+    img_x = x//2
+    
+    sprite_size = (img_x, y)
+    sprite = pygame.Surface(sprite_size, pygame.SRCALPHA)
+    sprite.blit( image, (0, 0) )
+    
+    alpha = pygame.surfarray.pixels_alpha(sprite)
+    
+    mask_area = pygame.Rect((img_x, 0), sprite_size)
+    mask = image.subsurface(mask_area)
+    mask_array = pygame.surfarray.array2d(mask)
+    
+    white_surface = pygame.Surface( mask_area.size )
+    white_surface.fill( pygame.Color(b"#ffffff") )
+    full_white = pygame.surfarray.array2d(white_surface)
+    
+    alpha[:] = full_white-mask_array
+    
+    del alpha
+    return sprite
+    
+    
+def bench_masks(options):
+    """Decoding ":a" sprites the old way, the new way, and many of them
+    at once on threads like the prefetcher does."""
+    
+    pygame.init()
+    batch = [ masked_image( (400, 600) ) for i in xrange(options.masks) ]
+    
+    old, new = packed_alpha_masked(batch[0]), images.alpha_masked(batch[0])
+    if (pygame.surfarray.array_alpha(old) != pygame.surfarray.array_alpha(new)).any():
+        print("the decoders don't agree!")
+        
+    for name, decode in ( ("packed pixels", packed_alpha_masked),
+                          ("alpha_masked", images.alpha_masked) ):
+        start = timeit.default_timer()
+        for image in batch:
+            decode(image)
+            
+        report(name, timeit.default_timer()-start, len(batch), "sprite")
+        
+    threads = max(pynscr_pygame.PREFETCH_THREADS, 1)
+    workers = multiprocessing.pool.ThreadPool(threads)
+    start = timeit.default_timer()
+    workers.map(images.alpha_masked, batch)
+    report( "alpha_masked, {0} threads".format(threads),
+            timeit.default_timer()-start, len(batch), "sprite" )
+    workers.terminate()
+    
+    
+def bench_archive(options):
+    """Decompressing the compressed entries of NSA archives, a screen
+    sized image of each kind."""
+    
+    width, height = pynscr_pygame.RESOLUTION
+    size = width*height*3
+    rng = random.Random(0)
+    
+    def noise(length):
+        return bytes( bytearray( rng.getrandbits(8) for i in xrange(length) ) )
+        
+    # any bits are a valid SPB or LZSS; enough of them for the worst case
+    spb = struct.pack(b">HH", width, height) + noise(size*35//32 + 16)
+    lzss = noise(size*9//8 + 16)
+    # a gradient compresses like pictures do, noise wouldn't
+    nbz = struct.pack(b">I", size) + \
+          bz2.compress( bytes( bytearray( i*7//width % 256 for i in xrange(size) ) ) )
+          
+    for name, data, decode, length in ( ("SPB", spb, compression.decode_spb, compression.spb_size(spb)),
+                                        ("LZSS", lzss, compression.decode_lzss, size),
+                                        ("NBZ", nbz, compression.decode_nbz, size) ):
+        out = bytearray(length)
+        start = timeit.default_timer()
+        decode(buffer(data), out)
+        report_throughput(name, timeit.default_timer()-start, length)
+        
+        
+BENCHMARKS = dict(render=bench_render, masks=bench_masks, archive=bench_archive)
+
+
+def main():
+    parser = optparse.OptionParser( usage="%prog [options] [BENCHMARK...]\n\nBenchmarks: " +
+                                          ", ".join( sorted(BENCHMARKS) ) )
+    parser.add_option("--frames", type="int", default=200,
+                      help="frames drawn per measurement")
+    parser.add_option("--sprites", type="int", default=20,
+                      help="sprites in the test scene")
+    parser.add_option("--masks", type="int", default=50,
+                      help="standing pictures with alpha masks decoded")
+    options, args = parser.parse_args()
+    
+    for name in args or sorted(BENCHMARKS):
+        if name not in BENCHMARKS:
+            parser.print_usage()
+            exit(1)
+            
+        BENCHMARKS[name](options)
+        
+        
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       compression.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""Decoders of the compressed entries of NSA archives: SPB, NScripter's
+own image format, LZSS with a 256 byte ring, and NBZ, which is bzip2
+with the length in front. They decode like ONScripter does, into a
+buffer made for the whole entry beforehand; SPB decodes to a BMP.
+
+The bits are read from a table of the 24 bits starting at every byte of
+the data, so reading a field is a lookup and a shift. LZSS copies are
+slice assignments, and the SPB values are taken out of their fields and
+added up with numpy once where they are is known."""
+
+from __future__ import division, print_function, unicode_literals
+
+import bz2
+import struct
+
+import numpy
+
+
+# the LZSS ring, and where in it the first byte goes: N-F of Okumura's
+# decoder, which ONScripter's is, F being the 15+2 longest copy
+RING_SIZE = 256
+RING_START = RING_SIZE-17
+
+BMP_HEADER = struct.Struct(b"<2sIHHIIiiHHIIiiII")
+
+# by the first 4 bits of an SPB group: the bits of its values, and the
+# bits of the whole group
+SPB_WIDTHS = numpy.array( [0, 0, 3, 3, 4, 4, 5, 5, 6, 6, 7, 7, 8, 8, 1, 2] )
+SPB_LENGTHS = ( numpy.array([3]*14 + [4, 4]) + 4*SPB_WIDTHS ).tolist()
+
+# how much bzip2 data is decompressed at once
+NBZ_CHUNK = 64*1024
+
+
+def bit_windows(data):
+    """The 24 bits starting at every byte of data, the first one being
+    the highest, as a numpy array. The bits after the data are 0."""
+    
+    padded = numpy.zeros( len(data)+3, numpy.uint32 )
+    padded[:len(data)] = numpy.frombuffer(data, numpy.uint8)
+    return padded[:-2] << 16 | padded[1:-1] << 8 | padded[2:]
+    
+    
+def decode_lzss(data, out):
+    """Fill out with what data decodes to; stops when it's full. Returns
+    how much was decoded."""
+    
+    windows = bit_windows(data).tolist()
+    end = len(data)*8
+    length = len(out)
+    
+    position = count = 0
+    while count < length and position+9 <= end:
+        window = windows[position >> 3]
+        shift = position & 7
+        
+        if window >> (23-shift) & 1:
+            # a byte as it is
+            out[count] = window >> (15-shift) & 0xff
+            position += 9
+            count += 1
+            continue
+            
+        # a copy from the ring: 8 bits of where, 4 of how much
+        field = window >> (11-shift) & 0xfff
+        position += 13
+        
+        start = field >> 4
+        copied = min( (field & 0xf)+2, length-count )
+        
+        # how far back the ring position is
+        distance = ( (RING_START+count-start-1) & (RING_SIZE-1) )+1
+        source = count-distance
+        
+        if source < 0:
+            # the ring starts out empty
+            for i in xrange(copied):
+                out[count+i] = out[source+i] if source+i >= 0 else 0
+                
+        elif copied <= distance:
+            out[count:count+copied] = out[source:source+copied]
+            
+        else:
+            # overlapping: the last distance bytes over and over
+            repeated = out[source:count] * (copied//distance+1)
+            out[count:count+copied] = repeated[:copied]
+            
+        count += copied
+        
+    return count
+    
+    
+def spb_size(data):
+    """The bytes of the BMP an SPB image decodes to."""
+    
+    width, height = struct.unpack_from(b">HH", data)
+    return _bmp_row(width)*height + BMP_HEADER.size
+    
+    
+def _bmp_row(width):
+    # rows of 24 bit BMPs are padded to 4 bytes
+    return (width*3+3) // 4 * 4
+    
+    
+def decode_spb(data, out):
+    """Decode an SPB image into out as a 24 bit BMP. Returns its size.
+    
+    An SPB has the width and the height, then the blue, green and red
+    planes of the image, each going from the top left in a snake: odd
+    rows are from right to left. A plane is its first value, then
+    groups of 4 values. A 3 bit number starts the group: 0 for four
+    times the last value, 6 for four new values of 8 bits, else four
+    differences from the last value of m bits each, where m is 1 or 2
+    (the next bit tells which) for 7 and the number+2 otherwise."""
+    
+    width, height = struct.unpack_from(b">HH", data)
+    row = _bmp_row(width)
+    size = row*height + BMP_HEADER.size
+    if len(out) < size:
+        raise ValueError("The SPB image doesn't fit")
+        
+    BMP_HEADER.pack_into( out, 0, b"BM", size, 0, 0, BMP_HEADER.size, 40, width,
+                          height, 1, 24, 0, size-BMP_HEADER.size, 0, 0, 0, 0 )
+    if width*height == 0:
+        return size
+        
+    body = numpy.frombuffer( out, numpy.uint8, row*height, BMP_HEADER.size )
+    # BMPs go from the bottom up
+    body = body.reshape(height, row)[::-1]
+    
+    table = bit_windows(data)
+    windows = table.tolist()
+    
+    pixels = width*height
+    groups = (pixels-1+3) // 4
+    position = 4*8
+    for channel in xrange(3):
+        first = windows[position >> 3] >> (16-(position & 7)) & 0xff
+        position += 8
+        
+        # where every group starts; only this has to go a group at a time
+        starts = [0]*groups
+        lengths = SPB_LENGTHS
+        for group in xrange(groups):
+            starts[group] = position
+            position += lengths[ windows[position >> 3] >> (20-(position & 7)) & 0xf ]
+            
+        plane = _spb_values( table, first, numpy.array(starts, numpy.int64) )[:pixels]
+        plane = plane.reshape(height, width)
+        plane[1::2] = plane[1::2, ::-1]
+        body[:, channel:width*3:3] = plane
+        
+    return size
+    
+    
+def _spb_values(table, first, starts):
+    # the fields of the groups; groups of repeats have none
+    codes = table[starts >> 3] >> (20-(starts & 7)) & 0xf
+    widths = SPB_WIDTHS[codes]
+    starts = starts + numpy.where(codes >= 14, 4, 3)
+    positions = starts[:, None] + widths[:, None]*numpy.arange(4)
+    widths = numpy.repeat(widths, 4)
+    positions = positions.ravel()
+    
+    windows = table[positions >> 3].astype(numpy.int64)
+    fields = windows >> (24-(positions & 7)-widths) & ( (1 << widths)-1 )
+    
+    # odd fields add, even ones take away
+    changes = numpy.where( fields & 1, (fields >> 1)+1, -(fields >> 1) )
+    
+    # the 8 bit fields (and the first value) are values, not changes
+    absolute = numpy.concatenate( ([True], widths == 8) )
+    values = numpy.concatenate( ([first], numpy.where(widths == 8, fields, 0)) )
+    changes = numpy.concatenate( ([0], numpy.where(widths == 8, 0, changes)) )
+    
+    # every value is the last absolute one with the changes since added
+    total = numpy.cumsum(changes)
+    last = numpy.maximum.accumulate( numpy.where(absolute, numpy.arange(len(absolute)), 0) )
+    return ( values[last] + total - total[last] ).astype(numpy.uint8)
+    
+    
+def nbz_size(data):
+    """The bytes an NBZ entry decompresses to."""
+    
+    return struct.unpack_from(b">I", data)[0]
+    
+    
+def decode_nbz(data, out):
+    """Decompress an NBZ entry into out, a piece at a time. Returns how
+    much was decompressed."""
+    
+    decompressor = bz2.BZ2Decompressor()
+    count = 0
+    for start in xrange(4, len(data), NBZ_CHUNK):
+        try:
+            got = decompressor.decompress( data[start:start+NBZ_CHUNK] )
+            
+        except EOFError:
+            # the stream ended before the data
+            break
+            
+        got = got[:len(out)-count]
+        out[count:count+len(got)] = got
+        count += len(got)
+        if count == len(out):
+            break
+            
+    return count
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       gamefiles.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""Finding the files of a game by the names its script uses.
+
+Scripts were written for Windows, so they name files in any case, with
+"\\" between directories. The game directory is scanned once into an
+index by normalized name, the way archive entries are found, so finding
+a file doesn't ask the filesystem and works on case sensitive ones."""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+
+import archive
+
+
+class GameFiles(object):
+    """The files in directory and in archives, an archive.ArchiveSet.
+    A loose file goes before an archived one of the same name. The
+    directories in ignored (e.g. caches) aren't looked in."""
+    
+    def __init__(self, directory, archives, ignored=()):
+        self.directory = directory
+        self.archives = archives
+        self.ignored = set( archive.normalized(name) for name in ignored if name != None )
+        
+        # normalized name -> path of the loose file
+        self._loose = {}
+        self.refresh()
+        
+        
+    def refresh(self):
+        """Scan the directory again, e.g. when files were added."""
+        
+        loose = {}
+        for root, directories, names in os.walk(self.directory):
+            relative = os.path.relpath(root, self.directory)
+            if relative == os.curdir:
+                directories[:] = [ name for name in directories
+                                   if archive.normalized(name) not in self.ignored ]
+                relative = ""
+                
+            for name in names:
+                path = os.path.normpath( os.path.join(self.directory, relative, name) )
+                loose[ archive.normalized( os.path.join(relative, name) ) ] = path
+                
+        self._loose = loose
+        
+        
+    def path(self, name):
+        """The path of the loose file called name, None if there's none."""
+        
+        return self._loose.get( archive.normalized(name) )
+        
+        
+    def exists(self, name):
+        return self.path(name) != None or name in self.archives
+        
+        
+    def open(self, name):
+        """What the loaders can load the file from: its path if it's
+        loose, else a file of its archive entry. A file that's nowhere
+        is left for the loader to complain about."""
+        
+        path = self.path(name)
+        if path != None:
+            return path
+            
+        if name in self.archives:
+            return self.archives.open(name)
+            
+        return name
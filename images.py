@@ -25,6 +25,7 @@
 from __future__ import division, print_function, unicode_literals
 
 import os
+import numpy
 import pygame
 
 def image_loader(directory):
@@ -41,11 +42,54 @@ def image_loader(directory):
 def load(path):
     # taken from the pygame chimp example, modified
     
-    image = pygame.image.load(path)
+    image = decoded(path)
     
     #~ image = image.convert()
-    image = image.convert_alpha()
+    return converted(image)
+    
+    
+def decoded(source):
+    # a path, or a file (e.g. in an archive) named by its name
+    return pygame.image.load( source, getattr(source, "name", "") )
+    
+    
+def converted(image):
+    # there's no display surface to convert to when
+    # drawing with textures
+    if pygame.display.get_surface() != None:
+        image = image.convert_alpha()
     
     return image
     
     
+def alpha_masked(image):
+    """The sprite of an image with an alpha mask (":a") as its right
+    half: the left half, as opaque as the mask is dark.
+    
+    Only the blue of the mask is looked at, like ONScripter does, since
+    masks are gray. It's inverted straight into the alpha of the sprite,
+    with no arrays in between."""
+    
+    width, height = image.get_size()
+    size = (width//2, height)
+    
+    sprite = pygame.Surface(size, pygame.SRCALPHA)
+    sprite.blit( image, (0, 0) )
+    
+    if image.get_bitsize() < 24:
+        # the channels of palette images can't be referenced
+        image = image.convert(24)
+        
+    mask = image.subsurface( pygame.Rect((size[0], 0), size) )
+    
+    alpha = pygame.surfarray.pixels_alpha(sprite)
+    numpy.invert( pygame.surfarray.pixels_blue(mask), out=alpha )
+    del alpha # otherwise we can't touch the sprite
+    
+    return sprite
+    
+    
+def surface_bytes(surface):
+    """The memory the pixels of a surface take."""
+    
+    return surface.get_pitch()*surface.get_height()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       imagestore.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+
+"""The decoded images of a game, each file decoded once however many
+ways it's shown.
+
+What a file decodes to is its source. The images made from it are
+views: a background or a ":c" sprite is the source itself, an ":a"
+sprite is composed from it and its alpha mask. The views sharing the
+source's pixels hold it, and it's kept while any of them is kept; the
+ones nothing holds are kept too, as many as the budget allows, for the
+next view of the same file."""
+
+from __future__ import division, print_function, unicode_literals
+
+import threading
+
+import pool
+import images
+
+
+class ImageStore(object):
+    """The sources decode(path) gives, with budget bytes of the ones
+    that aren't held kept; None keeps them all.
+    
+    Loaders on any thread can use it at the same time."""
+    
+    def __init__(self, decode, budget=None):
+        self._decode = decode
+        self._lock = threading.Lock()
+        
+        # path -> source, pinned once for every view holding it; sources
+        # are decoded without the lock and handed to it by _decoded
+        self._sources = pool.Pool( self._take, budget=budget, sizer=images.surface_bytes )
+        self._decoded = {}
+        
+        # path -> the Event of a decode going on, which
+        # the others asking for the same file wait for
+        self._decoding = {}
+        
+        # view -> [path, how many times it's held]
+        self._views = {}
+        
+        
+    def source(self, path):
+        """The source of path, decoded if it wasn't yet."""
+        
+        while True:
+            with self._lock:
+                if path in self._sources:
+                    return self._sources[path]
+                    
+                decoding = self._decoding.get(path)
+                if decoding == None:
+                    decoding = self._decoding[path] = threading.Event()
+                    break
+                    
+            decoding.wait()
+            # decoded, or failed and it's tried again
+            
+        try:
+            source = self._decode(path)
+            
+            with self._lock:
+                self._decoded[path] = source
+                return self._sources[path]
+                
+        finally:
+            with self._lock:
+                del self._decoding[path]
+                
+            decoding.set()
+            
+            
+    def _take(self, path):
+        # with the lock held
+        return self._decoded.pop(path)
+        
+        
+    def hold(self, path, view):
+        """Keep the source of path while view is kept, if view is the
+        source. Returns view.
+        
+        Views of a source that was dropped before they were held are
+        left alone; they're the only ones with those pixels anyway."""
+        
+        with self._lock:
+            if view in self._views:
+                self._views[view][1] += 1
+                
+            elif self._sources.get(path) is view:
+                self._views[view] = [path, 1]
+                
+            else:
+                return view
+                
+            self._sources.pin(path)
+            return view
+            
+            
+    def release(self, view):
+        """view, held or not, isn't kept anymore."""
+        
+        with self._lock:
+            if view not in self._views:
+                return
+                
+            held = self._views[view]
+            held[1] -= 1
+            if held[1] == 0:
+                del self._views[view]
+                
+            self._sources.unpin(held[0])
+            
+            
+    def stats(self):
+        # hits are views made of a source decoded already
+        with self._lock:
+            return self._sources.stats()
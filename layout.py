@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       layout.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""Measuring and line wrapping of text.
+
+Latin text is wrapped between words, Japanese (and other CJK) text
+between any two characters, except where the kinsoku rules forbid it:
+closing brackets, punctuation and small kana can't start a line and
+opening brackets can't end one."""
+
+from __future__ import division, print_function, unicode_literals
+
+
+# can't be at the start of a line
+NOT_AT_START = set( "!),.:;?]}" "、。，．・：；？！゛゜ヽヾゝゞ々ー"
+                    "）］｝〕〉》」』】〙〗〟’”｠»"
+                    "ぁぃぅぇぉっゃゅょゎゕゖァィゥェォッャュョヮヵヶ" )
+                    
+# can't be at the end of a line
+NOT_AT_END = set( "([{" "（［｛〔〈《「『【〘〖〝‘“｟«" )
+
+# (first, last) code points of the characters that can be broken anywhere
+CJK_RANGES = ( (0x2E80, 0x9FFF),   # radicals, punctuation, kana, ideographs
+               (0xAC00, 0xD7AF),   # hangul
+               (0xF900, 0xFAFF),   # compatibility ideographs
+               (0xFF00, 0xFFEF) )  # full and half width forms
+               
+               
+def is_cjk(c):
+    code = ord(c)
+    for first, last in CJK_RANGES:
+        if first <= code <= last:
+            return True
+            
+    return False
+    
+    
+def break_units(s):
+    """Split s into the pieces that can't be broken: words, single
+    spaces and single CJK characters, the latter two merged with their
+    neighbours where the kinsoku rules say so."""
+    
+    units = []
+    word = ""
+    for c in s:
+        if c == " " or is_cjk(c):
+            if word:
+                units.append(word)
+                word = ""
+                
+            units.append(c)
+            
+        else:
+            word += c
+            
+    if word:
+        units.append(word)
+        
+    # glue the units that can't be broken apart
+    glued = []
+    for unit in units:
+        if glued and unit != " " and glued[-1][-1] != " " and \
+        (unit[0] in NOT_AT_START or glued[-1][-1] in NOT_AT_END):
+            glued[-1] += unit
+            
+        else:
+            glued.append(unit)
+            
+    return glued
+    
+    
+class TextLayout(object):
+    """Lays out text for a font in lines of a given width.
+    
+    Positions are (line, x) pairs. The advance of every character is
+    asked from the font once, after that measuring is a table lookup
+    per character."""
+    
+    def __init__(self, font, width):
+        self.font = font
+        self.width = width
+        self._advances = {}
+        
+        
+    def advance(self, c):
+        try:
+            return self._advances[c]
+            
+        except KeyError:
+            metrics = self.font.metrics(c)
+            if metrics and metrics[0] != None:
+                advance = metrics[0][4]
+                
+            else:
+                # not in the font
+                advance = self.font.size(c)[0]
+                
+            self._advances[c] = advance
+            return advance
+            
+            
+    def measure(self, s):
+        return sum( self.advance(c) for c in s )
+        
+        
+    def wrap(self, s, line=0, x=0):
+        """Lay out s starting from (line, x). Returns the pieces as
+        (line, x, string) tuples, one per line, and the position after
+        the text."""
+        
+        pieces = []
+        piece = ""
+        piece_x = x
+        
+        def new_line():
+            if piece:
+                pieces.append( (line, piece_x, piece) )
+                
+            return line+1, 0, "", 0
+            
+        for unit in break_units(s):
+            width = self.measure(unit)
+            
+            # spaces can hang over the end of the line
+            if unit != " " and x+width > self.width and x > 0:
+                line, x, piece, piece_x = new_line()
+                
+            if width > self.width:
+                # too long for any line, so it's broken anywhere
+                for c in unit:
+                    advance = self.advance(c)
+                    if x+advance > self.width and x > 0:
+                        line, x, piece, piece_x = new_line()
+                        
+                    piece += c
+                    x += advance
+                    
+            else:
+                piece += unit
+                x += width
+                
+        if piece:
+            pieces.append( (line, piece_x, piece) )
+            
+        return pieces, line, x
+        
+        
+    def layout_page(self, items, line=0, x=0):
+        """Lay out a page in one pass. items are strings and None for
+        line breaks. Returns the pieces like wrap."""
+        
+        pieces = []
+        for item in items:
+            if item == None:
+                line, x = line+1, 0
+                
+            else:
+                got, line, x = self.wrap(item, line, x)
+                pieces.extend(got)
+                
+        return pieces, line, x
@@ -31,20 +31,102 @@ import functools
 import onscr_parse
 
 
+class WaitRequest(object):
+    """Something the interpreter needs from the player before it can
+    go on. The frontend answers it through InterpreterBase.resume."""
+    
+    def __init__(self, on_answer=None):
+        self.on_answer = on_answer
+        
+        
+    def resume(self, answer):
+        if self.on_answer != None:
+            self.on_answer(answer)
+            
+            
+class ClickWait(WaitRequest):
+    """@: wait for a click. The answer is ignored."""
+    
+    
+class PageWait(WaitRequest):
+    """\\: wait for a click, then start a new page. The answer is ignored."""
+    
+    
+class ChoiceWait(WaitRequest):
+    """select and selgosub. Answered with the index of the chosen text."""
+    
+    def __init__(self, choices, on_answer):
+        super(ChoiceWait, self).__init__(on_answer)
+        self.choices = choices
+        
+        
+class ButtonWait(WaitRequest):
+    """btnwait. The buttons are (num, topleft, size) tuples.
+    Answered with the num of the clicked button, 0 for a click
+    outside of every button and -1 for a right-click."""
+    
+    def __init__(self, buttons, on_answer):
+        super(ButtonWait, self).__init__(on_answer)
+        self.buttons = buttons
+        
+        
 class InterpreterBase(object):
     # This is supposed to be subclassed.
     
     def __init__(self, filename):
         self.parser = onscr_parse.CmdReader(filename)
         
+        self.running = False
         self.waiting = False
+        self.wait_request = None
+        
+        # the label we're under, for profiling
+        self.current_label = None
+        self._label_stack = []
+        
+        # see profiling.py
+        self.profiler = None
+        
+        
+    def execute(self):
+        """Run the script as a generator. Every time the script has
+        to wait for the player, a WaitRequest is yielded and the
+        generator has to be resumed with the answer through send().
         
+        Nothing blocks in here, so a frontend can drive as many
+        interpreters as it likes and render whenever it wants to."""
         
+        self.running = True
+        while True:
+            self.run_until_wait()
+            if not self.running:
+                return
+                
+            answer = yield self.wait_request
+            self.resume(answer)
+            
+            
     def run_until_wait(self):
-        while not self.waiting:
+        while not self.waiting and self.running:
             self.step()
             
             
+    def wait_for(self, request):
+        self.wait_request = request
+        self.waiting = True
+        
+        
+    def resume(self, answer=None):
+        """Answer the current WaitRequest and stop waiting."""
+        
+        request = self.wait_request
+        self.wait_request = None
+        self.waiting = False
+        
+        if request != None:
+            request.resume(answer)
+            
+            
     def step(self):
         statement = self.parser.read_next()
         #~ self.error( "DEBUG:"+str(statement) )
@@ -60,7 +142,7 @@ class InterpreterBase(object):
         else:
             assert statement[0][0] == b"*"
             # It's a label.
-            pass
+            self.current_label = statement[0].lower()
             
             
     def _run_cmd(self, cmd, args):
@@ -70,6 +152,10 @@ class InterpreterBase(object):
             self.error("**** Command '" + cmd + "' is not supported yet.")
             return
             
+        profiler = self.profiler
+        if profiler != None:
+            measurement = profiler.start()
+            
         try:
             func(*args)
             
@@ -77,25 +163,66 @@ class InterpreterBase(object):
             self.error( "Func error with: " + str(cmd) + " " + str(args) )
             raise
             
+        finally:
+            # the command running this one gets its time back either way
+            if profiler != None:
+                profiler.stop(measurement, cmd, self.current_label)
+            
             
     def error(self, s):
         print(s)
         
         
+    def snapshot(self):
+        """Return a picklable copy of the interpreter state.
+        Subclasses extend the returned dict."""
+        
+        return dict(parser=self.parser.snapshot())
+        
+        
+    def restore(self, state):
+        self.parser.restore(state["parser"])
+        self.waiting = False
+        self.wait_request = None
+        
+        
     # basic functions
     def do_game(self):
         self.do_goto("*start")
         
         
+    def do_end(self):
+        self.running = False
+        
+        
     def do_click(self):
         # the NScripter command for waiting until a click
-        self.waiting = True
+        self.wait_for( ClickWait() )
         
         
     def do_EOP(self):
         # EOP (end-of-page) is how the parser returns the
         # backslash special command
-        self.waiting = True
+        self.wait_for( PageWait(lambda answer: self.new_page()) )
+        
+        
+    def do_select(self, *args):
+        self.selection(args, self.do_goto)
+        
+        
+    def do_selgosub(self, *args):
+        self.selection(args, self.do_gosub)
+        
+        
+    def selection(self, args, jump):
+        texts, labels = unpack_args(args)
+        texts = [ self.unstr(t) for t in texts ]
+        
+        def chosen(i):
+            jump(labels[i])
+            self.new_page()
+            
+        self.wait_for( ChoiceWait(texts, chosen) )
         
         
     def do_goto(self, label):
@@ -107,10 +234,14 @@ class InterpreterBase(object):
         
         
     def do_gosub(self, label):
+        self._label_stack.append(self.current_label)
         self.parser.gosub(label)
         
         
     def do_return(self):
+        if self._label_stack:
+            self.current_label = self._label_stack.pop()
+            
         self.parser.cmd_return()
         
         
@@ -122,6 +253,11 @@ class InterpreterBase(object):
         pass
         
         
+    def new_page(self):
+        # the script moved on to a new page
+        self.clear()
+        
+        
     def is_name(self, v):
         return type(v) in (str, unicode) and not self.is_str(v)
         
@@ -151,6 +287,9 @@ class VarKeeper(InterpreterBase):
         self.numalias = dict()
         self.stralias = dict()
         
+        # defined with btndef and btn, used by btnwait
+        self.buttons = []
+        
         
     def load_var(self, var):
         """If the passed argument is a variable, a stralias,
@@ -202,6 +341,26 @@ class VarKeeper(InterpreterBase):
         return var
         
         
+    def snapshot(self):
+        state = super(VarKeeper, self).snapshot()
+        state["numeric_vars"] = dict(self.numeric_vars)
+        state["char_vars"] = dict(self.char_vars)
+        state["numalias"] = dict(self.numalias)
+        state["stralias"] = dict(self.stralias)
+        state["buttons"] = tuple(self.buttons)
+        
+        return state
+        
+        
+    def restore(self, state):
+        super(VarKeeper, self).restore(state)
+        self.numeric_vars = collections.defaultdict(int, state["numeric_vars"])
+        self.char_vars = collections.defaultdict(str, state["char_vars"])
+        self.numalias = dict(state["numalias"])
+        self.stralias = dict(state["stralias"])
+        self.buttons = list(state["buttons"])
+        
+        
     def do_numalias(self, name, value):
         self.numalias[name] = self.load_var(value)
         
@@ -299,6 +458,43 @@ class VarKeeper(InterpreterBase):
             self.numeric_vars[ var[1] ] = value
             
             
+    def do_btndef(self, name):
+        # currently we don't do anything with the name
+        
+        del self.buttons[:]
+        
+        
+    def do_btn(self, num, x, y, w, h, xshift=0, yshift=0):
+        # Note: xshift and yshift are not implemented
+        
+        self.buttons.append( (num, (x, y), (w, h)) )
+        
+        
+    def do_btnwait(self, var, clear=True):
+        def clicked(result):
+            if clear and result > 0:
+                del self.buttons[:]
+                
+            self.do_mov(var, result)
+            
+        self.wait_for( ButtonWait(list(self.buttons), clicked) )
+        
+        
+    def do_btnwait2(self, var):
+        self.do_btnwait(var, clear=False)
+        
+        
+def unpack_args(seq):
+    seq = list(seq)
+    a = []
+    b = []
+    for i in xrange( len(seq)//2 ):
+        a.append( seq[(i*2)] )
+        b.append( seq[i*2+1] )
+        
+    return a, b
+    
+    
 def variable_loader(f):
     @functools.wraps(f)
     def varloader(self, *args, **kwargs):
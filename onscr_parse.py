@@ -24,8 +24,9 @@
 
 from __future__ import division, print_function, unicode_literals
 
+import os
 import sys
-import codecs
+import copy
 
 import nscr
 
@@ -36,12 +37,14 @@ class LineReader(object):
     # So we use a procedural approach.
     
     START_LABEL = b"*define"
+    ENCODING = "sjis"
     
     def __init__(self, filename):
         self._lines = []
         self._labels = dict()
         self._gosub_stack = []
         
+        self.filename = filename
         self._read_file(filename)
         
         self.last_line = len(self._lines)-1
@@ -51,17 +54,150 @@ class LineReader(object):
         
     def _read_file(self, filename):
         # reads in lines and lists labels
-        with codecs.open(filename, 'r', encoding="sjis") as f:
-            for line in f:
-                line = line.strip().lstrip()
+        with open(filename, 'rb') as f:
+            self._raw = f.read()
+            
+        self._stat = self._file_stat()
+        self._lines = self._split_lines(self._raw)
+        self._add_labels(0, self._lines)
+        
+        
+    def _split_lines(self, raw):
+        # raw has to start at the beginning of a line. In Shift JIS
+        # the newline byte can't be part of a two byte character,
+        # so any line range can be decoded on its own.
+        lines = [ line.strip() for line in raw.decode(self.ENCODING).split("\n") ]
+        
+        if lines[-1] == "":
+            # the file (or range) ended with a newline
+            lines.pop()
+            
+        return lines
+        
+        
+    def _add_labels(self, first, lines):
+        # list labels
+        for i, line in enumerate(lines):
+            if len(line) > 1 and line[0] == b"*":
+                self._labels[line.lower()] = first+i
+                
+                
+    def _file_stat(self):
+        st = os.stat(self.filename)
+        return (st.st_mtime, st.st_size)
+        
+        
+    def changed(self):
+        """Check whether the script file was modified since it was read."""
+        
+        try:
+            return self._file_stat() != self._stat
+            
+        except OSError:
+            # probably in the middle of being saved
+            return False
+            
+            
+    def reload(self):
+        """Re-read the script after it was edited.
+        
+        Only the lines between the unchanged beginning and end of the
+        file are decoded again, and only the labels are updated, so the
+        time spent depends on the size of the edit. The current position
+        and the gosub stack are mapped onto the new script as label
+        plus offset. Returns the (first line, removed, added) counts."""
+        
+        with open(self.filename, 'rb') as f:
+            new = f.read()
+            
+        old = self._raw
+        self._stat = self._file_stat()
+        if new == old:
+            return (0, 0, 0)
+            
+        # the unchanged beginning, backed up to the start of a line
+        start = _common_prefix(old, new)
+        start = old.rfind(b"\n", 0, start) + 1
+        
+        # the unchanged end, moved forward to the start of a line
+        suffix = _common_suffix( old, new, min(len(old), len(new))-start )
+        old_end = len(old)-suffix
+        new_end = len(new)-suffix
+        if suffix > 0 and not (old[old_end-1:old_end] == new[new_end-1:new_end] == b"\n"):
+            newline = old.find(b"\n", old_end)
+            if newline == -1:
+                old_end, new_end = len(old), len(new)
                 
-                # list labels
-                if len(line) > 1 and line[0] == b"*":
-                    self._labels[line.lower()] = len(self._lines)
+            else:
+                new_end += newline+1-old_end
+                old_end = newline+1
+                
+        first = old.count(b"\n", 0, start)
+        removed = _line_count(old, start, old_end)
+        added_lines = self._split_lines(new[start:new_end]) if new_end > start else []
+        delta = len(added_lines)-removed
+        
+        # remember where we are before the labels move
+        positions = [ self._label_offset(line) for line in
+                      [self.current_line] + self._gosub_stack ]
+                      
+        old_labels = dict(self._labels)
+        for label, line in old_labels.items():
+            if line >= first+removed:
+                self._labels[label] = line+delta
+                
+            elif line >= first:
+                del self._labels[label]
+                
+        self._lines[first:first+removed] = added_lines
+        for i, line in enumerate(added_lines):
+            # like when reading, the last definition of a label wins
+            if len(line) > 1 and line[0] == b"*" and \
+            self._labels.get(line.lower(), -1) < first+len(added_lines):
+                self._labels[line.lower()] = first+i
+                
+        
+        # A removed label might still be defined somewhere else.
+        # That's rare, so a full search is fine.
+        for label in set(old_labels) - set(self._labels):
+            for i, line in enumerate(self._lines):
+                if line.lower() == label:
+                    self._labels[label] = i
                     
-                self._lines.append(line)
+        self._raw = new
+        self.last_line = len(self._lines)-1
+        
+        def relocate(position, line):
+            label, offset = position
+            if label in self._labels:
+                line = self._labels[label]+offset
+                
+            elif line >= first+removed:
+                line += delta
+                
+            elif line >= first:
+                line = first-1
                 
+            return max( -1, min(line, self.last_line) )
+            
+        lines = [self.current_line] + self._gosub_stack
+        lines = [ relocate(p, l) for p, l in zip(positions, lines) ]
+        self.current_line = lines[0]
+        self._gosub_stack = lines[1:]
+        
+        return (first, removed, len(added_lines))
+        
+        
+    def _label_offset(self, line):
+        # the closest label at or before the line
+        best = (None, line+1)
+        for label, label_line in self._labels.iteritems():
+            if best[1] > line-label_line >= 0:
+                best = (label, line-label_line)
                 
+        return best
+        
+        
     def _next_line(self):
         self.current_line += 1
         
@@ -87,6 +223,12 @@ class LineReader(object):
         self.current_line = self._labels[label]-1
         
         
+    def label_line(self, label):
+        """The line of a label, or None if there's no such label."""
+        
+        return self._labels.get( label.lower() )
+        
+        
     def gosub(self, label):
         self._gosub_stack.append( self.current_line )
         self.goto(label)
@@ -110,10 +252,63 @@ class LineReader(object):
         self.current_line -= 1
         
         
+    def snapshot(self):
+        """Return a picklable copy of the reading position."""
+        
+        return dict(current_line=self.current_line,
+                    gosub_stack=tuple(self._gosub_stack))
+                    
+                    
+    def restore(self, state):
+        self.current_line = state["current_line"]
+        self._gosub_stack = list(state["gosub_stack"])
+        
+        
     def error(self, msg):
         print("Strange.", msg)
         
         
+def _common_prefix(a, b, chunk=65536):
+    """The length of the common beginning of two byte strings."""
+    
+    limit = min( len(a), len(b) )
+    i = 0
+    # compare big chunks first, then narrow it down
+    while chunk >= 1:
+        while i+chunk <= limit and a[i:i+chunk] == b[i:i+chunk]:
+            i += chunk
+            
+        chunk //= 16
+        
+    return i
+    
+    
+def _common_suffix(a, b, limit, chunk=65536):
+    """The length of the common end of two byte strings, at most limit."""
+    
+    i = 0
+    while chunk >= 1:
+        while i+chunk <= limit and \
+        a[len(a)-i-chunk:len(a)-i] == b[len(b)-i-chunk:len(b)-i]:
+            i += chunk
+            
+        chunk //= 16
+        
+    return i
+    
+    
+def _line_count(raw, start, end):
+    # the number of lines in raw[start:end], start being a line start
+    if end <= start:
+        return 0
+        
+    count = raw.count(b"\n", start, end)
+    if raw[end-1:end] != b"\n":
+        count += 1
+        
+    return count
+    
+    
 class CmdReader(LineReader):
     ARG_SEP = b","
     
@@ -126,11 +321,20 @@ class CmdReader(LineReader):
         # for multi-line statements
         self.unfinished = b""
         
+        # Where the last command came from: the first line of its
+        # statement and its index among the commands of the statement.
+        self.position = (-1, -1)
+        self.last_command = None
+        self._stmt_line = -1
+        
         
     def read_next(self):
         while self._cmds == []:
             line = super(CmdReader, self).read_next()
-            if line.endswith(self.ARG_SEP) and (not line.startswith(b"`") or self.unfinished != b""):
+            if self.unfinished == b"":
+                self._stmt_line = self.current_line
+                
+            if self._continues(line):
                 self.unfinished += line
                 continue
             
@@ -140,8 +344,75 @@ class CmdReader(LineReader):
                     self.unfinished = b""
                     
                 self._cmds.extend( self.parse_line(line) )
+                self.position = (self._stmt_line, -1)
                 
-        return self._cmds.pop()
+        self.position = (self.position[0], self.position[1]+1)
+        self.last_command = self._cmds.pop()
+        return self.last_command
+        
+        
+    def _continues(self, line):
+        # whether the statement goes on in the next line
+        return line.endswith(self.ARG_SEP) and (not line.startswith(b"`") or self.unfinished != b"")
+        
+        
+    def command_at(self, position):
+        """Parse the statement at a position again and return the
+        command there, or None if it isn't there anymore."""
+        
+        line_no, index = position
+        if not 0 <= line_no <= self.last_line:
+            return None
+            
+        cmds = self.statement_at(line_no)[0]
+        if not 0 <= index < len(cmds):
+            return None
+            
+        return cmds[index]
+        
+        
+    def statement_at(self, line_no):
+        """Parse the statement starting at a line, without reading it.
+        Returns its commands in order and the line after it."""
+        
+        first = line_no
+        line = self._lines[line_no]
+        while line.endswith(self.ARG_SEP) and line_no < self.last_line and \
+        (not line.startswith(b"`") or line_no != first):
+            line_no += 1
+            line += self._lines[line_no]
+            
+        # parse_line gives the commands in reverse order
+        cmds = list( self.parse_line(line) )
+        cmds.reverse()
+        
+        return cmds, line_no+1
+        
+        
+    def pending(self):
+        """The commands left from the statement read last, in order."""
+        
+        return self._cmds[::-1]
+        
+        
+    def snapshot(self):
+        state = super(CmdReader, self).snapshot()
+        # load_var changes variable arguments in place,
+        # so the pending commands have to be copied.
+        state["cmds"] = copy.deepcopy(self._cmds)
+        state["unfinished"] = self.unfinished
+        state["position"] = self.position
+        state["stmt_line"] = self._stmt_line
+        
+        return state
+        
+        
+    def restore(self, state):
+        super(CmdReader, self).restore(state)
+        self._cmds = copy.deepcopy(state["cmds"])
+        self.unfinished = state["unfinished"]
+        self.position = state["position"]
+        self._stmt_line = state["stmt_line"]
         
         
     def parse_line(self, line):
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       pixelcache.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""Decoded images kept on disk, so the next run doesn't decode them
+again.
+
+An entry is named by a hash of the file it was decoded from and by how
+it was decoded (e.g. ":a" for sprites with alpha masks), so a changed
+file is simply a different entry. It holds the RGBA pixels, which are
+mapped into memory and made into a surface as they are; they're only
+copied if there's a display surface to convert them to. When the
+entries take more space than allowed, the ones used longest ago are
+deleted."""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import mmap
+import struct
+import hashlib
+import threading
+import collections
+
+import numpy
+import pygame
+
+import images
+
+
+# magic, width, height; the pixels follow
+HEADER = struct.Struct(b"<8sII")
+MAGIC = b"NPYPIX01"
+SUFFIX = ".rgba"
+
+
+class PixelCache(object):
+    """The entries in the directory path, at most max_bytes of them.
+    With no path, nothing is kept and load() just decodes.
+    
+    Loaders on any thread can use it at the same time."""
+    
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        
+        self._lock = threading.Lock()
+        # (path, size, mtime) of a file -> hash of its contents
+        self._digests = {}
+        # entry name -> bytes, the one used longest ago first
+        self._entries = collections.OrderedDict()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        if path != None and os.path.isdir(path):
+            self._scan()
+            
+            
+    def _scan(self):
+        # the last run's entries, in the order they were used
+        found = []
+        for name in os.listdir(self.path):
+            if name.endswith(SUFFIX):
+                stat = os.stat( os.path.join(self.path, name) )
+                found.append( (stat.st_mtime, name, stat.st_size) )
+                
+        for mtime, name, size in sorted(found):
+            self._entries[name] = size
+            
+        # the budget might be smaller than last time
+        self._evict(None)
+        
+        
+    def load(self, path, mode, decode):
+        """The surface decode(path) gives, from the cache if the file
+        was decoded this way before. Surfaces from the cache are
+        converted like images.load converts.
+        
+        path can also be an archive.EntryFile."""
+        
+        if self.path == None:
+            return decode(path)
+            
+        try:
+            name = "{0}-{1}{2}".format( self._digest(path), mode.strip(":") or "image", SUFFIX )
+            
+        except (IOError, OSError):
+            # let decode fail on it
+            return decode(path)
+            
+        surface = self._read(name)
+        if surface != None:
+            self.hits += 1
+            return images.converted(surface)
+            
+        self.misses += 1
+        surface = decode(path)
+        self._write(name, surface)
+        return surface
+        
+        
+    def _digest(self, path):
+        if hasattr(path, "stamp"):
+            # an archive entry
+            stamp = path.stamp
+            
+        else:
+            stat = os.stat(path)
+            stamp = (path, stat.st_size, stat.st_mtime)
+            
+        digest = self._digests.get(stamp)
+        if digest == None:
+            if hasattr(path, "stored"):
+                digest = hashlib.sha1( path.stored ).hexdigest()
+                
+            else:
+                with open(path, "rb") as f:
+                    digest = hashlib.sha1( f.read() ).hexdigest()
+                    
+            self._digests[stamp] = digest
+            
+        return digest
+        
+        
+    def _read(self, name):
+        with self._lock:
+            if name not in self._entries:
+                return None
+                
+            # used now
+            self._entries[name] = self._entries.pop(name)
+            
+        entry = os.path.join(self.path, name)
+        try:
+            with open(entry, "rb") as f:
+                # a private mapping, so drawing on the surface
+                # doesn't touch the file
+                mapped = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_COPY )
+                
+            os.utime(entry, None)
+            magic, width, height = HEADER.unpack_from(mapped)
+            if magic != MAGIC or len(mapped) != HEADER.size + width*height*4:
+                raise ValueError("broken entry")
+                
+        except (IOError, OSError, ValueError, struct.error):
+            with self._lock:
+                self._entries.pop(name, None)
+                
+            return None
+            
+        # the surface keeps the array alive, and that the mapping
+        pixels = numpy.frombuffer( mapped, numpy.uint8, offset=HEADER.size )
+        return pygame.image.frombuffer( pixels, (width, height), "RGBA" )
+        
+        
+    def _write(self, name, surface):
+        width, height = surface.get_size()
+        entry = os.path.join(self.path, name)
+        # loaders on other threads might write the same entry
+        temporary = "{0}.{1}.tmp".format( entry, threading.current_thread().ident )
+        
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+                
+            with open(temporary, "wb") as f:
+                f.write( HEADER.pack(MAGIC, width, height) )
+                f.write( pygame.image.tostring(surface, "RGBA") )
+                
+            if os.path.exists(entry):
+                os.remove(entry)
+                
+            os.rename(temporary, entry)
+            
+        except (IOError, OSError):
+            # no room, or read only; the game goes on without it
+            return
+            
+        with self._lock:
+            self._entries.pop(name, None)
+            self._entries[name] = HEADER.size + width*height*4
+            self._evict(name)
+            
+            
+    def _evict(self, keep):
+        # with the lock held
+        resident = sum( self._entries.itervalues() )
+        for name in list(self._entries):
+            if resident <= self.max_bytes or name == keep:
+                break
+                
+            resident -= self._entries.pop(name)
+            self.evictions += 1
+            try:
+                # mapped surfaces of it still work
+                os.remove( os.path.join(self.path, name) )
+                
+            except OSError:
+                pass
+                
+                
+    def stats(self):
+        with self._lock:
+            return dict( hits=self.hits, misses=self.misses, evictions=self.evictions,
+                         items=len(self._entries), resident=sum( self._entries.itervalues() ) )
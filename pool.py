@@ -24,24 +24,148 @@
 
 from __future__ import division, print_function, unicode_literals
 
+import collections
+
 class _SuperPool(dict):
+    """A dict that loads what it doesn't have yet.
+    
+    With a budget it only keeps that much: sizer tells what an item
+    costs, and the least recently used items that aren't pinned are
+    dropped when there's more. Without one everything is kept, and the
+    cost is only counted.
+    
+    dropped, if it's given, is called with the key and the item of
+    everything taken out, by eviction or otherwise."""
+    
     def __init__(self, loader, *args, **kwargs):
+        self.budget = kwargs.pop("budget", None)
+        self.sizer = kwargs.pop("sizer", None)
+        self.dropped = kwargs.pop("dropped", None)
         super(_SuperPool, self).__init__(*args, **kwargs)
         self.loader = loader
         
+        # the cost of every item, the least recently used first
+        self._order = collections.OrderedDict( (key, self._size(value))
+                                               for key, value in self.iteritems() )
+        self._pins = {}
+        
+        self.resident = sum( self._order.itervalues() )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        
+    def _size(self, value):
+        if self.sizer == None:
+            return 0
+            
+        return self.sizer(value)
+        
+        
+    def _fetch(self, key, *args):
+        # the item of key, loaded with args if it isn't here
+        if key in self:
+            self.hits += 1
+            if self.budget != None:
+                self._order[key] = self._order.pop(key)
+                
+            return dict.__getitem__(self, key)
+            
+        self.misses += 1
+        value = self.loader(*args)
+        self[key] = value
+        self._evict(keep=key)
+        
+        return value
+        
+        
+    def __setitem__(self, key, value):
+        if key in self:
+            self.resident -= self._order.pop(key)
+            self._drop( key, dict.__getitem__(self, key) )
+            
+        super(_SuperPool, self).__setitem__(key, value)
+        self._order[key] = self._size(value)
+        self.resident += self._order[key]
+        
+        
+    def __delitem__(self, key):
+        value = dict.__getitem__(self, key)
+        super(_SuperPool, self).__delitem__(key)
+        self.resident -= self._order.pop(key)
+        self._drop(key, value)
+        
         
+    def clear(self):
+        items = self.items()
+        super(_SuperPool, self).clear()
+        self._order.clear()
+        self.resident = 0
+        for key, value in items:
+            self._drop(key, value)
+            
+            
+    def _drop(self, key, value):
+        if self.dropped != None:
+            self.dropped(key, value)
+        
+        
+    def pin(self, key):
+        """Keep key from being dropped, until it's unpinned
+        as many times as it was pinned."""
+        
+        self._pins[key] = self._pins.get(key, 0)+1
+        
+        
+    def unpin(self, key):
+        # a key that isn't pinned stays unpinned
+        count = self._pins.pop(key, 0)-1
+        if count > 0:
+            self._pins[key] = count
+            
+        else:
+            self._evict()
+            
+            
+    def _evict(self, keep=None):
+        if self.budget == None or self.resident <= self.budget:
+            return
+            
+        excess = self.resident-self.budget
+        dropped = []
+        for key, size in self._order.iteritems():
+            if excess <= 0:
+                break
+                
+            if key != keep and key not in self._pins:
+                dropped.append(key)
+                excess -= size
+                
+        for key in dropped:
+            del self[key]
+            
+        self.evictions += len(dropped)
+        
+        
+    def stats(self):
+        return dict( hits=self.hits, misses=self.misses, evictions=self.evictions,
+                     resident=self.resident, items=len(self), pinned=len(self._pins) )
+                     
+                     
 class Pool(_SuperPool):
     def __getitem__(self, i):
-        if i not in self:
-            self[i] = self.loader(i)
-            
-        return super(Pool, self).__getitem__(i)
+        return self._fetch(i, i)
         
         
 class DynamicPool(_SuperPool):
     def __call__(self, *args):
-        if args not in self:
-            self[args] = self.loader(self, *args)
+        return self._fetch(args, self, *args)
         
-        return super(DynamicPool, self).__getitem__(args)
         
+class LRUPool(Pool):
+    """A Pool that only keeps the maxsize most recently used items."""
+    
+    def __init__(self, loader, maxsize, *args, **kwargs):
+        kwargs.update( budget=maxsize, sizer=lambda value: 1 )
+        super(LRUPool, self).__init__(loader, *args, **kwargs)
+        self.maxsize = maxsize
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       prefetch.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""Loading what the script is about to show before it shows it.
+
+While the player reads, the statements after the current one are
+scanned for the assets they use, and those are loaded by a pool of
+threads. The frontend's pools get them through the loaders add()
+returns: a command finds its asset loaded already, still loading (and
+waits for it) or not asked for (and loads it itself)."""
+
+from __future__ import division, print_function, unicode_literals
+
+import multiprocessing.pool
+
+import pool
+
+
+# command -> (index of the argument naming the asset, kind of asset)
+ASSET_ARGS = { "bg": (0, "images"),
+               "ld": (1, "sprites"),
+               "lsp": (1, "sprites"),
+               "wave": (0, "sounds"),
+               "waveloop": (0, "sounds"),
+               "dwave": (1, "sounds"),
+               "dwaveloop": (1, "sounds"),
+               "play": (0, "music") }
+               
+# scanning follows these to their label
+JUMPS = set( ["goto", "gosub"] )
+
+# and stops at these: where the script goes on from depends
+# on the player or on things not known yet
+STOPS = set( ["select", "selgosub", "btnwait", "btnwait2", "return",
+              "end", "jumpf", "skip"] )
+              
+# their commands might run
+CONDITIONALS = set( ["if", "notif"] )
+
+# marks what a load didn't give
+_NOTHING = object()
+
+
+class Prefetcher(object):
+    """Loads the assets of the next lookahead statements of a CmdReader
+    on threads threads; none turns prefetching off.
+    
+    Only the thread running the script may call the methods here."""
+    
+    def __init__(self, reader, resolve, threads=2, lookahead=50):
+        # resolve turns an argument into its value, None if it
+        # can't be known before the command runs
+        self.reader = reader
+        self.resolve = resolve
+        self.lookahead = lookahead
+        
+        self._workers = multiprocessing.pool.ThreadPool(threads) if threads > 0 else None
+        # kind -> (loader, key); see add()
+        self._kinds = {}
+        # (kind, key) -> AsyncResult
+        self._jobs = {}
+        # jobs started before the last cancel() aren't loaded anymore
+        self._generation = 0
+        # parsed statements by their first line
+        self._statements = pool.LRUPool(reader.statement_at, lookahead*4)
+        
+        # loads found done, still loading and not prefetched,
+        # and loads dropped before they were done
+        self.hits = 0
+        self.waits = 0
+        self.misses = 0
+        self.cancelled = 0
+        
+        
+    def add(self, kind, load, key):
+        """Prefetch a kind of asset. load loads one by its key, and key
+        makes the key from the argument of the command, or returns None
+        if there's nothing to load (e.g. it's loaded already).
+        
+        Returns load wrapped so it gives what was prefetched,
+        for the pool the assets are kept in."""
+        
+        self._kinds[kind] = (load, key)
+        
+        def prefetched(key):
+            return self.claim(kind, key)()
+            
+        return prefetched
+        
+        
+    def claim(self, kind, key):
+        """What the loader add() returned would give for key, as a
+        function that can be called on any thread, e.g. to wait for it
+        somewhere else."""
+        
+        job = self._jobs.pop( (kind, key), None )
+        if job == None:
+            self.misses += 1
+            
+        elif job.ready():
+            self.hits += 1
+            
+        else:
+            self.waits += 1
+            
+        load = self._kinds[kind][0]
+        
+        def claimed():
+            value = _NOTHING
+            if job != None:
+                try:
+                    value = job.get()
+                    
+                except Exception:
+                    # it's loaded again, to fail where it would have
+                    pass
+                    
+            return load(key) if value is _NOTHING else value
+            
+        return claimed
+            
+            
+    def scan(self):
+        """Start loading what the coming statements use, and drop
+        what was loaded for statements that aren't coming anymore."""
+        
+        if self._workers == None:
+            return
+            
+        wanted = set()
+        for name, args in self.upcoming():
+            kind = ASSET_ARGS[name][1]
+            if kind not in self._kinds:
+                continue
+                
+            load, make_key = self._kinds[kind]
+            index = ASSET_ARGS[name][0]
+            arg = self.resolve( args[index] ) if index < len(args) else None
+            key = make_key(arg) if arg != None else None
+            if key == None:
+                continue
+                
+            wanted.add( (kind, key) )
+            if (kind, key) not in self._jobs:
+                self._jobs[(kind, key)] = self._workers.apply_async( self._load,
+                                                                     (self._generation, load, key) )
+                                                                     
+        for job in set(self._jobs)-wanted:
+            if not self._jobs.pop(job).ready():
+                self.cancelled += 1
+            
+            
+    def upcoming(self):
+        """The commands loading assets in the next statements, as far as
+        it can be known where the script goes."""
+        
+        reader = self.reader
+        cmds = reader.pending()
+        line = reader.current_line+1
+        
+        for i in xrange(self.lookahead):
+            for cmd in cmds:
+                if len(cmd) != 2:
+                    # a label
+                    continue
+                    
+                name, args = cmd
+                if name in ASSET_ARGS:
+                    yield cmd
+                    
+                elif name in CONDITIONALS:
+                    for sub in args[1]:
+                        if len(sub) == 2 and sub[0] in ASSET_ARGS:
+                            yield sub
+                            
+                elif name in JUMPS:
+                    label = self.resolve(args[0])
+                    line = reader.label_line(label) if label != None else None
+                    if line == None:
+                        return
+                        
+                    break
+                    
+                elif name in STOPS:
+                    return
+                    
+            if line > reader.last_line:
+                return
+                
+            try:
+                cmds, line = self._statements[line]
+                
+            except Exception:
+                # a line the parser doesn't understand; the
+                # script will complain about it when it gets there
+                return
+                
+                
+    def _load(self, generation, load, key):
+        # in a worker thread
+        if generation != self._generation:
+            return _NOTHING
+            
+        return load(key)
+        
+        
+    def cancel(self):
+        """Drop everything asked for, e.g. when the script went where the
+        scan didn't expect."""
+        
+        self._generation += 1
+        self.cancelled += sum( not job.ready() for job in self._jobs.itervalues() )
+        self._jobs.clear()
+        
+        
+    def reset(self):
+        # the script was reloaded, so the lines are different
+        self.cancel()
+        self._statements.clear()
+        
+        
+    def close(self):
+        if self._workers != None:
+            self._workers.terminate()
+            
+            
+    def stats(self):
+        return dict( hits=self.hits, waits=self.waits, misses=self.misses,
+                     cancelled=self.cancelled, items=len(self._jobs) )
+                     
+                     
+def read_file(path):
+    """Read a file and forget it, so it's in the OS's cache when the
+    thing that can't be loaded ahead (e.g. streamed music) opens it."""
+    
+    with open(path, "rb") as f:
+        while f.read(1 << 20):
+            pass
+            
+    return None
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       profiling.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""Per-command profiling of the interpreter.
+
+Both frontends take a --profile[=FILE] option. Without a FILE the
+report is printed on exit, with a .json FILE it's written as JSON and
+otherwise as the same text that would be printed."""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import sys
+import json
+import codecs
+import timeit
+import collections
+
+
+OPTION = "--profile"
+
+timer = timeit.default_timer
+
+
+class _Stats(object):
+    __slots__ = ("calls", "total", "max", "args")
+    
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.args = 0.0
+        
+        
+    def add(self, elapsed, args):
+        self.calls += 1
+        self.total += elapsed
+        self.args += args
+        if elapsed > self.max:
+            self.max = elapsed
+            
+            
+    def as_dict(self):
+        return dict(calls=self.calls, total=self.total, max=self.max, args=self.args)
+        
+        
+class CommandProfiler(object):
+    """Counts calls and wall time of every do_* handler, and the part of
+    it spent loading arguments (load_var), per command and per label.
+    
+    Times are inclusive: an if contains the commands it ran. So are the
+    ones per label, which add up the commands that finished under it;
+    a command an if ran is counted there as well as in the if, so the
+    label times can add up to more than the time the script ran.
+    
+    A command that raises is measured up to where it raised."""
+    
+    def __init__(self, path=None):
+        # where to write the report; None means stdout
+        self.path = path
+        
+        self.commands = collections.defaultdict(_Stats)
+        self.labels = collections.defaultdict(_Stats)
+        
+        self.arg_time = 0.0
+        self._loading = False
+        
+        # time spent waiting for the player, and CPU used meanwhile
+        self.wait_time = 0.0
+        self.wait_cpu = 0.0
+        
+        # the stats() of the interpreter's pools, by name
+        self.caches = {}
+        # and of its prefetcher
+        self.prefetch = None
+        # name -> [loads, seconds, most seconds] of the sounds
+        # and music that had to be loaded before playing
+        self.audio = None
+        
+        
+    def attach(self, interpreter):
+        """Start profiling an interpreter. When no profiler is attached,
+        the interpreter only pays for an attribute check per command."""
+        
+        interpreter.profiler = self
+        
+        load_var = getattr(interpreter, "load_var", None)
+        if load_var == None:
+            return
+            
+        def timed_load_var(var):
+            # load_var calls itself for nested variables
+            if self._loading:
+                return load_var(var)
+                
+            self._loading = True
+            start = timer()
+            try:
+                return load_var(var)
+                
+            finally:
+                self.arg_time += timer()-start
+                self._loading = False
+                
+        interpreter.load_var = timed_load_var
+        
+        
+    def start(self):
+        measurement = (timer(), self.arg_time)
+        self.arg_time = 0.0
+        
+        return measurement
+        
+        
+    def stop(self, measurement, cmd, label):
+        start, outer_arg_time = measurement
+        elapsed = timer()-start
+        
+        self.commands[cmd].add(elapsed, self.arg_time)
+        self.labels[label].add(elapsed, self.arg_time)
+        
+        # the command running this one (e.g. an if) includes it
+        self.arg_time += outer_arg_time
+        
+        
+    def add_wait(self, before):
+        # before is what process_times() returned
+        wall, cpu = process_times()
+        self.wait_time += wall-before[0]
+        self.wait_cpu += cpu-before[1]
+        
+        
+    def report(self, out=sys.stdout):
+        def table(title, stats):
+            print(title, file=out)
+            header = "{0:<24} {1:>9} {2:>11} {3:>10} {4:>10} {5:>11}"
+            print(header.format("", "calls", "total ms", "mean us", "max ms", "args ms"), file=out)
+            
+            row = "{0:<24} {1:>9} {2:>11.2f} {3:>10.1f} {4:>10.2f} {5:>11.2f}"
+            for name, s in sorted( stats.items(), key=lambda item: -item[1].total ):
+                print(row.format( unicode(name), s.calls, s.total*1000,
+                                  s.total/s.calls*1000000, s.max*1000, s.args*1000 ), file=out)
+                                  
+            print(file=out)
+            
+        table("Commands:", self.commands)
+        table("Labels:", self.labels)
+        
+        if self.wait_time > 0:
+            info = "Waiting for the player: {0:.1f} s, {1:.2f} s CPU ({2:.2f} CPU s per minute)"
+            per_minute = self.wait_cpu/self.wait_time*60
+            print(info.format(self.wait_time, self.wait_cpu, per_minute), file=out)
+            
+        if self.caches:
+            print(file=out)
+            print("Caches:", file=out)
+            header = "{0:<24} {1:>9} {2:>9} {3:>10} {4:>8} {5:>12}"
+            print(header.format("", "hits", "misses", "evictions", "items", "resident"), file=out)
+            
+            row = "{0:<24} {1:>9} {2:>9} {3:>10} {4:>8} {5:>12}"
+            for name, c in sorted( self.caches.items() ):
+                print(row.format( name, c["hits"], c["misses"], c["evictions"],
+                                  c["items"], c["resident"] ), file=out)
+                                  
+        if self.prefetch:
+            print(file=out)
+            info = "Prefetched: {hits} loaded ahead, {waits} still loading, " \
+                   "{misses} not asked for, {cancelled} cancelled"
+            print(info.format(**self.prefetch), file=out)
+            
+        if self.audio:
+            print(file=out)
+            print("Audio loaded before playing:", file=out)
+            header = "{0:<40} {1:>6} {2:>14} {3:>14}"
+            print(header.format("", "loads", "mean ms", "most ms"), file=out)
+            
+            row = "{0:<40} {1:>6} {2:>14.3f} {3:>14.3f}"
+            for name, (loads, seconds, most) in sorted( self.audio.items(),
+                                                        key=lambda item: -item[1][2] ):
+                print(row.format( name, loads, seconds/loads*1000, most*1000 ), file=out)
+                                  
+                                  
+    def as_dict(self):
+        return dict( commands=dict( (k, v.as_dict()) for k, v in self.commands.items() ),
+                     labels=dict( (unicode(k), v.as_dict()) for k, v in self.labels.items() ),
+                     waiting=dict(time=self.wait_time, cpu=self.wait_cpu),
+                     caches=self.caches, prefetch=self.prefetch, audio=self.audio )
+                     
+                     
+    def finish(self):
+        """Print the report or write it to the file given."""
+        
+        if self.path == None:
+            self.report()
+            
+        elif self.path.endswith(".json"):
+            with open(self.path, "w") as f:
+                json.dump(self.as_dict(), f, indent=1)
+                
+        else:
+            with codecs.open(self.path, "w", encoding="utf-8") as f:
+                self.report(f)
+                
+                
+def process_times():
+    """Wall clock and CPU time (user plus system) of the process."""
+    
+    times = os.times()
+    return ( timer(), times[0]+times[1] )
+    
+    
+def parse_argv(argv):
+    """Take the --profile[=FILE] option out of argv.
+    Returns the rest of argv and a CommandProfiler, or None
+    if profiling wasn't asked for."""
+    
+    rest = []
+    profiler = None
+    for arg in argv:
+        if arg == OPTION:
+            profiler = CommandProfiler()
+            
+        elif arg.startswith(OPTION + "="):
+            # the frontends chdir to the game's directory
+            path = os.path.abspath( arg[len(OPTION)+1:] )
+            profiler = CommandProfiler(path)
+            
+        else:
+            rest.append(arg)
+            
+    return rest, profiler
@@ -26,12 +26,26 @@ from __future__ import division, print_function, unicode_literals
 
 import sys
 import os
+import Queue
+import weakref
+import threading
+import collections
 import pygame
-import itertools
 
+import atlas
 import matrix
 import pool
 import images
+import layout
+import backlog
+import sprites
+import audio
+import archive
+import prefetch
+import gamefiles
+import pixelcache
+import profiling
+import imagestore
 import onscr_interpreter
 
 
@@ -39,12 +53,23 @@ SCRIPT_NAME = "0.txt"
 
 CLICK_BUTTON = 1
 RBUTTON = 3
+WHEEL_UP = 4
+WHEEL_DOWN = 5
 SKIP_KEY = pygame.K_s
 FULLSCREEN_KEY = pygame.K_f
+BACKLOG_KEYS = (pygame.K_PAGEUP, pygame.K_PAGEDOWN)
 
 # View
 RESOLUTION = (640, 480)
+SPRITE_SLOTS = 1000
 
+# if more than this part of the screen changed, all of it is redrawn
+DIRTY_FULL_RATIO = 0.5
+
+# the window has to be redrawn after these
+EXPOSE_EVENTS = set( getattr(pygame, name) for name in
+                     ("VIDEOEXPOSE", "ACTIVEEVENT", "WINDOWEXPOSED") if hasattr(pygame, name) )
+                     
 BORDER_WIDTH_MULTIPLIER = 0.8
 
 DIR_FONT = "default.ttf"
@@ -53,92 +78,1086 @@ FONT_SIZE = 17
 OUTLINE_COLOR = b"#000000"
 TEXT_COLOR = b"#ffffff"
 
+# number of rendered pieces of text kept
+TEXT_CACHE_SIZE = 2000
+
+# bytes of loaded images and sprites kept for later, besides the ones
+# on the screen; None keeps everything
+IMAGE_CACHE_BYTES = 64*1024*1024
+SPRITE_CACHE_BYTES = 64*1024*1024
+
+# bytes of decoded files kept to make more images and sprites of,
+# besides the ones those use
+SOURCE_CACHE_BYTES = 64*1024*1024
+
+# threads loading the images and sounds of the coming statements while
+# the player reads, 0 for none, and how many statements they look ahead
+PREFETCH_THREADS = 2
+PREFETCH_LOOKAHEAD = 50
+
+# where rendered glyphs are kept between runs, e.g. "glyphcache" in
+# the game's directory; None doesn't keep them
+GLYPH_CACHE_DIR = None
+
+# where decoded images are kept between runs, e.g. "pixelcache" in the
+# game's directory, None to not keep them; and how many bytes of them
+PIXEL_CACHE_DIR = None
+PIXEL_CACHE_BYTES = 512*1024*1024
+
+# bytes of compressed archive entries kept decompressed
+ARCHIVE_CACHE_BYTES = 32*1024*1024
+
+# the dwave channels, wave playing on the first, and
+# the bytes of decoded sounds kept for later
+SOUND_CHANNELS = 50
+SOUND_CACHE_BYTES = 32*1024*1024
+
+# threads loading the sounds the script plays before they were loaded,
+# and the milliseconds those fade in, 0 for none
+AUDIO_THREADS = 2
+AUDIO_FADE_MS = 30
+
+# number of pages remembered for the backlog
+BACKLOG_SIZE = 10000
+BACKLOG_SHADE = 160 # alpha of the black over the scene
+
+# characters shown per second, 0 shows the text at once
+TEXT_SPEED = 0
+
+# Wait for the display's refresh while animating, if possible
+VSYNC = False
+
+# How scenes get on the screen: "surface" blits them onto the display
+# surface, "texture" draws them from textures with an SDL renderer
+# (pygame 2) and "software" does the same with SDL's software renderer
+DISPLAY_BACKEND = "surface"
+
 # etc
 DEBUG_MODE = False
 
+# Reread the script when it's edited, for playtesting
+HOT_RELOAD = False
+HOT_RELOAD_INTERVAL = 500 # milliseconds
 
-class TextlessInterpreter(onscr_interpreter.VarKeeper):
+# Run the script in a thread of its own, so loading and running
+# commands doesn't hold up drawing and input
+THREADED = False
+
+# tells the display thread there's a new scene to draw
+SCENE_EVENT = pygame.USEREVENT
+
+# SDL_BLENDMODE_BLEND, for textures
+BLENDMODE_BLEND = 1
+
+
+def merge_rects(rects):
+    """Union the overlapping rects, so that no area is drawn twice."""
+    
+    merged = []
+    for rect in rects:
+        if rect.width <= 0 or rect.height <= 0:
+            continue
+            
+        # a union might overlap rects that were merged before
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect = rect.union( merged.pop(i) )
+            i = rect.collidelist(merged)
+            
+        merged.append(rect)
+        
+    return merged
+    
+    
+def join_rects(a, b):
+    # two lists of changed rects, where None means everything
+    if a == None or b == None:
+        return None
+        
+    return a+b
+    
+    
+def sound_bytes(sound):
+    """The memory the samples of a sound take."""
+    
+    frequency, size, channels = pygame.mixer.get_init()
+    return int( sound.get_length()*frequency ) * abs(size)//8 * channels
+    
+    
+# What the interpreter shows, handed to the renderer. A new one is made
+# whenever something changed and none of it is changed afterwards (bg is
+# replaced, never drawn on), so it can be drawn while the script goes on.
+# dirty_rects and scene_rects are where it differs from the one before,
+# None meaning everywhere; text changes are found by the renderer.
+Scene = collections.namedtuple( "Scene", ["bg", "sprites", "standing_pictures", "text",
+                                          "page", "page_chars", "shown_chars", "text_speed",
+                                          "skip_mode", "backlog", "caption",
+                                          "dirty_rects", "scene_rects"] )
+                                          
+                                          
+class SceneRenderer(object):
+    """Draws Scenes on the display.
+    
+    The background, sprites and standing pictures are composed onto a
+    surface, and the text onto a layer, both kept between frames, so
+    only what changed from one scene to the next is drawn again. The
+    typewriter is here too: how much of the text is shown is only a
+    matter of drawing."""
+    
     MAX_FPS = 60
-    VIEW_UPDATE_FREQ = 1
+    ANIMATION_FPS = 60
+    # number of rendered backlog pages kept
+    BACKLOG_CACHE_SIZE = 4
+    
+    def __init__(self, resolution, font_name):
+        self.resolution = resolution
+        self.surface = None
+        # set by StandaloneInterpreter if the display waits for vsync
+        self.vsync = False
+        self.clock = pygame.time.Clock()
+        
+        # the scene drawn last, and whether the display has to be
+        # redrawn and where; None means all of it
+        self.view = None
+        self.dirty = True
+        self.dirty_rects = None
+        
+        # the background, sprites and standing pictures flattened;
+        # composed_rects are the parts that have to be composed again
+        self.composed = None
+        self.composed_rects = None
+        
+        self.colors = pool.Pool(pygame.Color)
+        
+        # a font of its own, the interpreter's might be used by
+        # another thread; the layout is only used for measuring
+        self.font_name = font_name
+        self.font = pygame.font.Font(font_name, FONT_SIZE)
+        self.layout = layout.TextLayout( self.font, resolution[0] )
+        
+        # Rendered text, and the text of the page drawn on a layer of
+        # its own. layer_words is how many of the scene's text pieces
+        # are on it, None if it has to be drawn again.
+        self.rendered_words = pool.LRUPool(self.render_word, TEXT_CACHE_SIZE)
+        self.glyph_atlases = pool.Pool(self.load_atlas)
+        self.text_layer = None
+        self.layer_words = None
+        self.layer_changed = False
+        
+        # The typewriter: reveal characters of the page are to be shown
+        # and layer_shown are on the layer already, layer_chars of them
+        # from the piece after the layer_words ones.
+        self.reveal = 0
+        self.reveal_tick = 0
+        self.layer_chars = 0
+        self.layer_shown = 0
+        
+        # backlog pages by their serial, the last used last
+        self.backlog_pages = collections.OrderedDict()
+        self.backlog_shade = pygame.Surface(resolution)
+        self.backlog_shade.set_alpha(BACKLOG_SHADE)
+        
+        
+    def set_surface(self, surface):
+        self.surface = surface
+        # the scene is composed in the format of the display
+        self.composed = None
+        self.mark_dirty()
+        
+        
+    def mark_dirty(self, rect=None):
+        """Something changed on the screen. rect is where,
+        None means everywhere."""
+        
+        self.dirty = True
+        if rect == None:
+            self.dirty_rects = None
+            
+        elif self.dirty_rects != None:
+            self.dirty_rects.append( pygame.Rect(rect) )
+            
+            
+    def dirty_regions(self):
+        # the rects to redraw, or None if it's better to redraw everything
+        if self.dirty_rects == None:
+            return None
+            
+        screen = pygame.Rect( (0, 0), self.resolution )
+        rects = merge_rects( r.clip(screen) for r in self.dirty_rects )
+        
+        area = sum( r.width*r.height for r in rects )
+        if area > screen.width*screen.height*DIRTY_FULL_RATIO:
+            return None
+            
+        return rects
+        
+        
+    def show(self, scene):
+        """Take a new scene to draw."""
+        
+        old = self.view
+        was_typing = self.typing()
+        self.view = scene
+        self.dirty = True
+        
+        if scene.dirty_rects == None:
+            self.mark_dirty()
+            
+        else:
+            for rect in scene.dirty_rects:
+                self.mark_dirty(rect)
+                
+        if scene.scene_rects == None:
+            self.composed_rects = None
+            
+        elif self.composed_rects != None:
+            self.composed_rects.extend(scene.scene_rects)
+            
+        if old == None or scene.backlog != old.backlog:
+            self.mark_dirty()
+            
+        now = pygame.time.get_ticks()
+        if old == None or scene.page != old.page:
+            # another page; the old text goes away
+            if old != None:
+                self.mark_text_dirty(old.text)
+                
+            self.layer_words = None
+            self.reveal = scene.shown_chars
+            self.reveal_tick = now
+            
+        elif not was_typing:
+            # typing starts from the new text
+            self.reveal = old.page_chars
+            self.reveal_tick = now
+            
+        if old == None or scene.caption != old.caption:
+            if scene.caption != None:
+                self.set_caption(scene.caption)
+                
+                
+    def set_caption(self, caption):
+        pygame.display.set_caption(caption)
+        
+        
+    def update(self, scene=None):
+        """Draw a frame, of a new scene if one is given. Idle: nothing is
+        drawn. Animating: either the display's vsync or the clock paces
+        the frames."""
+        
+        if scene != None:
+            self.show(scene)
+            
+        if self.view == None or not (self.dirty or self.animating()):
+            return
+            
+        if not self.vsync:
+            self.clock.tick( self.ANIMATION_FPS if self.animating() else self.MAX_FPS )
+            
+        self.animate()
+        self.draw_frame()
+        
+        
+    def draw_frame(self):
+        rects = self.dirty_regions()
+        self.dirty = False
+        self.dirty_rects = []
+        
+        if rects == None:
+            self.draw_everything()
+            
+        else:
+            # every layer is drawn again, but only inside the rect
+            for rect in rects:
+                self.surface.set_clip(rect)
+                self.draw_everything()
+                
+            self.surface.set_clip(None)
+            
+        if self.vsync:
+            # the renderer behind the window can only show it all
+            pygame.display.flip()
+            
+        elif rects == None:
+            pygame.display.update()
+            
+        elif rects:
+            pygame.display.update(rects)
+            
+            
+    def typing(self):
+        # whether the typewriter is still showing the text
+        view = self.view
+        return view != None and view.text_speed > 0 and not view.skip_mode \
+               and self.reveal < view.page_chars
+               
+               
+    def animating(self):
+        # whether something moves on the screen by itself
+        return self.typing()
+        
+        
+    def animate(self):
+        # moves the typewriter to where it is in this frame,
+        # marking the pieces of text getting new characters
+        if self.typing():
+            now = pygame.time.get_ticks()
+            self.reveal += (now-self.reveal_tick)*self.view.text_speed/1000
+            self.reveal = min(self.reveal, self.view.page_chars)
+            self.reveal_tick = now
+            
+        if self.layer_words == None:
+            # all of the layer is drawn again anyway
+            self.mark_text_dirty(self.view.text)
+            return
+            
+        limit = self.shown_chars()
+        shown = self.layer_shown-self.layer_chars
+        for topleft, s in self.view.text[self.layer_words:]:
+            if shown >= limit:
+                break
+                
+            self.mark_dirty( self.text_rect(topleft, s) )
+            shown += len(s)
+            
+            
+    def complete_typing(self):
+        self.reveal = self.view.page_chars
+        self.mark_text_dirty(self.view.text)
+        
+        
+    def shown_chars(self):
+        # how many characters of the page are shown
+        return int(self.reveal) if self.typing() else self.view.page_chars
+        
+        
+    def draw_everything(self):
+        # the layers below the text
+        self.compose_scene()
+        self.surface.blit( self.composed, (0, 0) )
+        
+        if self.view.backlog != None:
+            self.surface.blit( self.backlog_shade, (0, 0) )
+            page = self.backlog_page(self.view.backlog)
+            self.surface.blit( page, (0, 0), special_flags=pygame.BLEND_PREMULTIPLIED )
+            
+        elif self.view.text:
+            self.update_text_layer()
+            self.surface.blit( self.text_layer, (0, 0), special_flags=pygame.BLEND_PREMULTIPLIED )
+            
+            
+    def compose_scene(self):
+        # only the parts the scene commands changed since the last
+        # time are composed again, the rest of self.composed is kept
+        if self.composed == None:
+            self.composed = self.surface.copy()
+            self.composed_rects = None
+            
+        if self.composed_rects == None:
+            rects = [ self.composed.get_rect() ]
+            
+        else:
+            rects = merge_rects(self.composed_rects)
+            
+        view = self.view
+        for rect in rects:
+            self.composed.set_clip(rect)
+            
+            # background
+            self.composed.blit( view.bg, (0, 0) )
+            
+            # sprites, from the highest number to the lowest
+            for sprite in view.sprites:
+                if sprite.visible and sprite.alpha > 0:
+                    self.blit_sprite(self.composed, sprite)
+                    
+            # standing pictures
+            for picture in view.standing_pictures:
+                self.composed.blit(picture.image, picture.topleft)
+                
+        self.composed.set_clip(None)
+        self.composed_rects = []
+        
+        
+    def blit_sprite(self, surface, sprite):
+        img = sprite.image
+        if sprite.alpha >= 255:
+            surface.blit(img, sprite.topleft)
+            return
+            
+        # the image might be shown elsewhere too, so
+        # its own alpha is only changed for this blit
+        before = img.get_alpha()
+        img.set_alpha(sprite.alpha)
+        surface.blit(img, sprite.topleft)
+        img.set_alpha(before)
+        
+        
+    def backlog_page(self, backlog):
+        # backlog is the serial of the page and its laid out text;
+        # pages are only rendered when shown, the last few are kept
+        serial, words = backlog
+        if serial in self.backlog_pages:
+            page = self.backlog_pages.pop(serial)
+            
+        else:
+            page = pygame.Surface(self.resolution, pygame.SRCALPHA)
+            self.draw_text(page, words)
+            
+        self.backlog_pages[serial] = page
+        while len(self.backlog_pages) > self.BACKLOG_CACHE_SIZE:
+            self.backlog_pages.popitem(last=False)
+            
+        return page
+        
+        
+    def update_text_layer(self):
+        # only the characters shown since the last frame are drawn
+        if self.text_layer == None:
+            self.text_layer = pygame.Surface(self.resolution, pygame.SRCALPHA)
+            self.layer_words = None
+            
+        if self.layer_words == None:
+            self.text_layer.fill( (0, 0, 0, 0) )
+            self.layer_words = 0
+            self.layer_chars = 0
+            self.layer_shown = 0
+            self.layer_changed = True
+            
+        text = self.view.text
+        limit = self.shown_chars()
+        
+        while self.layer_words < len(text) and self.layer_shown < limit:
+            topleft, s = text[self.layer_words]
+            end = min( len(s), self.layer_chars+limit-self.layer_shown )
+            self.draw_text_part(self.text_layer, topleft, s, self.layer_chars, end)
+            self.layer_changed = True
+            
+            self.layer_shown += end-self.layer_chars
+            if end == len(s):
+                self.layer_words += 1
+                self.layer_chars = 0
+                
+            else:
+                self.layer_chars = end
+                
+                
+    def draw_text_part(self, surface, topleft, s, start, end):
+        # the characters of s from start to end, where they'd be in s
+        rendered = self.rendered_text(s)
+        
+        area = rendered.get_rect()
+        if start > 0:
+            area.left = self.layout.measure(s[:start])
+            
+        if end < len(s):
+            area.width = self.layout.measure(s[:end])-area.left
+            
+        else:
+            area.width -= area.left
+            
+        pos = (topleft[0]+area.left, topleft[1])
+        surface.blit( rendered, pos, area, special_flags=pygame.BLEND_PREMULTIPLIED )
+        
+        
+    def draw_text(self, surface, words):
+        for topleft, s in words:
+            surface.blit( self.rendered_text(s), topleft, special_flags=pygame.BLEND_PREMULTIPLIED )
+            
+            
+    def text_rect(self, topleft, s):
+        # the area of a piece of text, with its outline
+        return pygame.Rect( topleft, self.rendered_text(s).get_size() )
+        
+        
+    def mark_text_dirty(self, text):
+        if text:
+            rects = [ self.text_rect(topleft, s) for topleft, s in text ]
+            self.mark_dirty( rects[0].unionall(rects[1:]) )
+            
+            
+    def rendered_text(self, s):
+        return self.rendered_words[ (s, self.font, TEXT_COLOR, OUTLINE_COLOR) ]
+        
+        
+    def render_word(self, key):
+        # the text with its outline, put together from the glyph atlas
+        s, font, color, outline_color = key
+        return self.glyph_atlases[ (font, color, outline_color) ].render(s)
+        
+        
+    def load_atlas(self, key):
+        font, color, outline_color = key
+        
+        path = None
+        stamp = None
+        if GLYPH_CACHE_DIR != None:
+            # one atlas per font, size and colors
+            if self.font_name == None:
+                name = "default"
+                stamp = pygame.version.ver
+                
+            else:
+                name = os.path.basename(self.font_name)
+                st = os.stat(self.font_name)
+                stamp = "{0} {1}".format(st.st_size, st.st_mtime)
+                
+            name = "{0}-{1}-{2}-{3}".format( name, FONT_SIZE, color.lstrip(b"#"),
+                                             outline_color.lstrip(b"#") )
+            path = os.path.join(GLYPH_CACHE_DIR, name)
+            
+        return atlas.GlyphAtlas( font, self.colors[color], self.colors[outline_color],
+                                 path, stamp )
+                                 
+                                 
+    def save_glyphs(self):
+        for glyphs in self.glyph_atlases.itervalues():
+            glyphs.save()
+            
+            
+class TextureSceneRenderer(SceneRenderer):
+    """Draws Scenes with an SDL renderer, through pygame 2's _sdl2.video:
+    blending, the alpha of sprites and scaling the scene to the window
+    are done by the renderer instead of blits. Every image is uploaded
+    as a texture the first time it's shown and kept while it exists.
+    
+    Frames are drawn whole, dirty rects only tell whether to draw one.
+    With software, SDL's software renderer is used, which needs no GPU."""
+    
+    def __init__(self, resolution, font_name, software=False):
+        # raises ImportError for builds of pygame without it
+        from pygame._sdl2 import video
+        
+        super(TextureSceneRenderer, self).__init__(resolution, font_name)
+        
+        self.video = video
+        self.window = video.Window("pynscr", resolution, resizable=True)
+        self.sdl_renderer = video.Renderer( self.window, accelerated=0 if software else -1,
+                                            vsync=VSYNC and not software )
+        self.vsync = VSYNC and not software
+        # the scene is scaled to the window
+        self.sdl_renderer.logical_size = resolution
+        
+        # by the surfaces they were made of
+        self.textures = weakref.WeakKeyDictionary()
+        
+        self.shade_texture = video.Texture.from_surface(self.sdl_renderer, self.backlog_shade)
+        self.shade_texture.alpha = BACKLOG_SHADE
+        self.shade_texture.blend_mode = BLENDMODE_BLEND
+        self.layer_texture = None
+        
+        
+    def set_fullscreen(self, fullscreen):
+        if fullscreen:
+            self.window.set_fullscreen(desktop=True)
+            
+        else:
+            self.window.set_windowed()
+            
+        self.mark_dirty()
+        
+        
+    def set_caption(self, caption):
+        self.window.title = caption
+        
+        
+    def texture(self, surface, premultiplied=False):
+        try:
+            return self.textures[surface]
+            
+        except KeyError:
+            if premultiplied:
+                # SDL has no blend mode for it
+                texture = self.video.Texture.from_surface( self.sdl_renderer,
+                                                           atlas.unpremultiplied(surface) )
+                texture.blend_mode = BLENDMODE_BLEND
+                
+            else:
+                texture = self.video.Texture.from_surface(self.sdl_renderer, surface)
+                
+            self.textures[surface] = texture
+            return texture
+            
+            
+    def draw_frame(self):
+        self.dirty = False
+        self.dirty_rects = []
+        view = self.view
+        
+        self.sdl_renderer.draw_color = (0, 0, 0, 255)
+        self.sdl_renderer.clear()
+        
+        self.texture(view.bg).draw()
+        
+        # sprites, from the highest number to the lowest
+        for sprite in view.sprites:
+            if sprite.visible and sprite.alpha > 0:
+                texture = self.texture(sprite.image)
+                # an image might be a sprite more than once
+                texture.alpha = min(sprite.alpha, 255)
+                texture.draw(dstrect=sprite.rect)
+                
+        # standing pictures
+        for picture in view.standing_pictures:
+            texture = self.texture(picture.image)
+            texture.alpha = 255
+            texture.draw(dstrect=picture.rect)
+            
+        if view.backlog != None:
+            self.shade_texture.draw()
+            self.texture( self.backlog_page(view.backlog), premultiplied=True ).draw()
+            
+        elif view.text:
+            self.update_text_layer()
+            if self.layer_texture == None:
+                self.layer_texture = self.video.Texture(self.sdl_renderer, self.resolution,
+                                                        streaming=True)
+                self.layer_texture.blend_mode = BLENDMODE_BLEND
+                self.layer_changed = True
+                
+            if self.layer_changed:
+                self.layer_texture.update( atlas.unpremultiplied(self.text_layer) )
+                self.layer_changed = False
+                
+            self.layer_texture.draw()
+            
+        self.sdl_renderer.present()
+        
+        
+class TextlessInterpreter(onscr_interpreter.VarKeeper):
+    # While nothing changes on the screen we sleep until an event comes,
+    # but wake up this often (in ms) for things like HOT_RELOAD.
+    IDLE_TIMEOUT = 250
+    # how often a script running in its own thread hands over
+    # what it did while it's not waiting, in ms
+    PUBLISH_INTERVAL = 1000//SceneRenderer.MAX_FPS
     
     def __init__(self, filename):
         super(TextlessInterpreter, self).__init__(filename)
         
+        # Font
+        if os.path.exists(DIR_FONT):
+            self.font_name = DIR_FONT
+            
+        else:
+            self.error( "No {0}. Falling back to pygame default font.".format(DIR_FONT) )
+            self.font_name = None # pygame default
+            
+        self.renderer = self.make_renderer()
+        
         # graphics
         self.bg = pygame.Surface(self.resolution)
         
         self.standing_pictures = dict() # valid keys are: 'l', 'c' and 'r'
-        self.sprites = dict() # valid keys are numbers in the range 0-999
-        
-        self.view_cycle = itertools.cycle( xrange(self.VIEW_UPDATE_FREQ) )
-        
-        self.clock = pygame.time.Clock()
-        
-        # pools
+        self.sprites = sprites.SpriteTable(SPRITE_SLOTS)
+        self.caption = None
+        
+        # whether anything changed since the last scene was taken, and
+        # where; None means everywhere. scene_rects are the changes of
+        # the background, sprites and standing pictures.
+        self.dirty = True
+        self.dirty_rects = None
+        self.scene_rects = None
+        
+        # pools; the images are loaded ahead by the prefetcher
+        self.prefetcher = prefetch.Prefetcher( self.parser, self.prefetch_arg,
+                                               PREFETCH_THREADS, PREFETCH_LOOKAHEAD )
+                                               
+        # the game's files, extracted or not
+        self.files = gamefiles.GameFiles( ".", archive.ArchiveSet(".", ARCHIVE_CACHE_BYTES),
+                                          ignored=(GLYPH_CACHE_DIR, PIXEL_CACHE_DIR) )
+        self.pixels = pixelcache.PixelCache(PIXEL_CACHE_DIR, PIXEL_CACHE_BYTES)
         self.colors = pool.Pool(pygame.Color)
-        self.images = pool.Pool( images.image_loader(".") )
-        self.spritepool = pool.Pool( self.load_sprite )
+        
+        # every file is decoded once, the images and sprites are made
+        # from that; the ones that are what was decoded hold it
+        self.sources = imagestore.ImageStore( self.decode_source, SOURCE_CACHE_BYTES )
+        release = lambda key, image: self.sources.release(image)
+        
+        load_image = self.prefetcher.add( "images", self.load_image, self.image_key )
+        self.images = pool.Pool( lambda path: self.sources.hold( path, load_image(path) ),
+                                 budget=IMAGE_CACHE_BYTES, sizer=images.surface_bytes,
+                                 dropped=release )
+        # the ones shown are pinned
+        load_sprite = self.prefetcher.add( "sprites", self.load_sprite, self.sprite_key )
+        self.spritepool = pool.Pool( lambda description: self.sources.hold( self.sprite_path(description),
+                                                                            load_sprite(description) ),
+                                     budget=SPRITE_CACHE_BYTES, sizer=images.surface_bytes,
+                                     dropped=release )
+                                     
+        load_sound = self.prefetcher.add( "sounds", self.load_sound, self.sound_key )
+        self.sounds = pool.Pool( load_sound, budget=SOUND_CACHE_BYTES, sizer=sound_bytes )
+        
+        # music is streamed, it's only read so the OS has it
+        self.prefetcher.add( "music", prefetch.read_file, self.music_key )
         
         # setup
-        self.running = False
         self.skip_mode = False
+        self.last_script_check = 0
+        
+        # set by run_threaded
+        self.threaded = False
         
         # audio
-        self.wavesound = None
+        if pygame.mixer.get_init():
+            pygame.mixer.set_num_channels(SOUND_CHANNELS)
+            
+        self.audio = audio.AsyncPlayer(self.error, AUDIO_THREADS, AUDIO_FADE_MS)
+            
+            
+    def make_renderer(self):
+        return SceneRenderer(self.resolution, self.font_name)
+        
+        
+    def cache_stats(self):
+        # resident is in bytes for the images, in pieces for the text
+        self.keep_sounds()
+        return dict( images=self.images.stats(), sprites=self.spritepool.stats(),
+                     sources=self.sources.stats(),
+                     text=self.renderer.rendered_words.stats(),
+                     sounds=self.sounds.stats(), pixels=self.pixels.stats(),
+                     archives=self.files.archives.stats() )
+                     
+                     
+    def prefetch_arg(self, arg):
+        # the value of an argument of a command that hasn't run yet,
+        # or None if it depends on variables
+        if self.is_name(arg):
+            return self.unalias(arg)
+            
+        if type(arg) == list:
+            return None
+            
+        return arg
+        
+        
+    def image_key(self, arg):
+        # what do_bg would load
+        if not self.is_str(arg):
+            return None
+            
+        path = self.localize_path(arg)
+        return None if path in self.images else path
+        
+        
+    def sprite_key(self, arg):
+        if not self.is_str(arg) or arg in self.spritepool:
+            return None
+            
+        # the ones load_sprite would complain about are left to it
+        if self.unstr(arg).split(";")[0] not in (":a", ":c"):
+            return None
+            
+        return arg
+        
+        
+    def sound_key(self, arg):
+        if not self.is_str(arg):
+            return None
+            
+        path = self.localize_path(arg)
+        return None if path in self.sounds or not self.files.exists(path) else path
+        
+        
+    def music_key(self, arg):
+        try:
+            path = self.music_path(arg) if self.is_str(arg) else None
+            
+        except ValueError:
+            return None
+            
+        return self.files.path(path) if path != None else None
         
         
     def set_surface(self, surface):
-        self._surface = surface
+        self.renderer.set_surface(surface)
+        
+        
+    def mark_dirty(self, rect=None):
+        """Something changed on the screen. rect is where,
+        None means everywhere."""
+        
+        self.dirty = True
+        if rect == None:
+            self.dirty_rects = None
+            
+        elif self.dirty_rects != None:
+            self.dirty_rects.append( pygame.Rect(rect) )
+            
+            
+    def scene_changed(self, rect=None):
+        """The background, a sprite or a standing picture changed."""
         
+        if rect == None:
+            self.scene_rects = None
+            
+        elif self.scene_rects != None:
+            self.scene_rects.append( pygame.Rect(rect) )
+            
+        self.mark_dirty(rect)
+        
+        
+    def take_scene(self):
+        """A Scene of what's on the screen now. The changes
+        are counted from here on."""
         
+        scene = Scene( **self.scene_fields() )
+        self.dirty = False
+        self.dirty_rects = []
+        self.scene_rects = []
+        
+        return scene
+        
+        
+    def scene_fields(self):
+        # sprites are replaced instead of changed, so they can be shared
+        rects = lambda rects: None if rects == None else tuple(rects)
+        return dict( bg=self.bg, sprites=tuple(self.sprites),
+                     standing_pictures=tuple( self.standing_pictures.itervalues() ),
+                     text=(), page=0, page_chars=0, shown_chars=0, text_speed=0,
+                     skip_mode=self.skip_mode, backlog=None, caption=self.caption,
+                     dirty_rects=rects(self.dirty_rects), scene_rects=rects(self.scene_rects) )
+                     
+                     
     def run(self):
         self.running = True
+        if THREADED:
+            self.run_threaded()
+            return
+            
         while self.running:
             self.update()
             
             
+    def run_threaded(self):
+        # The script runs in a thread of its own and hands its scenes
+        # over to this one, which draws them and passes the events on:
+        # SDL wants the display and the events in the main thread.
+        self.threaded = True
+        self.events = Queue.Queue()
+        self.scene_lock = threading.Lock()
+        self.new_scene = None
+        self.published = 0
+        self.script_error = None
+        
+        script = threading.Thread(target=self.run_script)
+        script.daemon = True
+        script.start()
+        
+        while self.running:
+            with self.scene_lock:
+                scene, self.new_scene = self.new_scene, None
+                
+            self.renderer.update(scene)
+            
+            idle = not (self.renderer.dirty or self.renderer.animating())
+            events = self.display_events(idle)
+            if idle and not events:
+                # wakes the script up for things like HOT_RELOAD
+                self.events.put(None)
+                
+            for event in events:
+                if event.type == SCENE_EVENT or self.view_event(event):
+                    continue
+                    
+                self.events.put(event)
+                if self.exit_event_check(event):
+                    self.running = False
+                    
+        script.join()
+        if self.script_error != None:
+            raise self.script_error[0], self.script_error[1], self.script_error[2]
+            
+            
+    def run_script(self):
+        # the script's side of run_threaded
+        try:
+            while self.running:
+                self.update()
+                
+                interval = pygame.time.get_ticks()-self.published
+                if self.dirty and interval >= self.PUBLISH_INTERVAL:
+                    # long runs of commands are shown as they go
+                    self.publish()
+                    
+        except SystemExit:
+            pass
+            
+        except:
+            self.script_error = sys.exc_info()
+            
+        finally:
+            self.running = False
+            pygame.event.post( pygame.event.Event(SCENE_EVENT) )
+            
+            
+    def publish(self):
+        # hands the scene over to the display thread
+        if not self.dirty:
+            return
+            
+        scene = self.take_scene()
+        with self.scene_lock:
+            if self.new_scene != None:
+                # it wasn't drawn, so its changes are drawn with this one's
+                old = self.new_scene
+                scene = scene._replace( dirty_rects=join_rects(old.dirty_rects, scene.dirty_rects),
+                                        scene_rects=join_rects(old.scene_rects, scene.scene_rects) )
+                                        
+            self.new_scene = scene
+            
+        self.published = pygame.time.get_ticks()
+        pygame.event.post( pygame.event.Event(SCENE_EVENT) )
+        
+        
     def update(self):
         if self.waiting:
-            if next(self.view_cycle) == 0:
-                self.update_view()
+            if self.profiler != None:
+                before = profiling.process_times()
                 
+            self.update_view()
             self.user_update()
             
+            if self.profiler != None:
+                self.profiler.add_wait(before)
+                
         else:
             self.step()
             
             
-            
     def user_update(self):
         # Events
-        for event in pygame.event.get():
+        for event in self.get_events():
             self.check_event(event)
             
         # Skip mode
-        if self.skip_mode:
-            self.waiting = False
+        if self.skip_mode and self.is_click_wait():
+            self.resume()
+            
+        if HOT_RELOAD:
+            self.check_script()
+            
+            
+    def check_script(self):
+        now = pygame.time.get_ticks()
+        if now-self.last_script_check < HOT_RELOAD_INTERVAL:
+            return
+            
+        self.last_script_check = now
+        if self.parser.changed():
+            first, removed, added = self.parser.reload()
+            self.prefetcher.reset()
+            self.files.refresh()
+            info = "Script reloaded: {0} lines replaced by {1} at line {2}"
+            self.error( info.format(removed, added, first+1) )
+            
+            
+    def get_events(self):
+        if self.threaded:
+            return self.forwarded_events()
+            
+        # Blocks for a while if there's nothing to draw,
+        # so a waiting game doesn't use the CPU.
+        idle = not (self.dirty or self.renderer.animating() or self.skip_mode)
+        return [ event for event in self.display_events(idle) if not self.view_event(event) ]
+        
+        
+    def display_events(self, block=False):
+        # if block, waits for an event for a while
+        if not block:
+            return pygame.event.get()
+            
+        event = pygame.event.wait(self.IDLE_TIMEOUT)
+        if event.type == pygame.NOEVENT:
+            return []
+            
+        return [event] + pygame.event.get()
+        
+        
+    def forwarded_events(self):
+        # the events the display thread passed on; blocks until
+        # there's one, or a None that only wakes us up
+        events = []
+        if not self.skip_mode:
+            events.append( self.events.get() )
+            
+        while True:
+            try:
+                events.append( self.events.get_nowait() )
+                
+            except Queue.Empty:
+                break
+                
+        return [ event for event in events if event != None ]
+        
+        
+    def view_event(self, event):
+        """Handle an event that only concerns the display, in the thread
+        owning it. Returns True if the event was used up."""
+        
+        if event.type in EXPOSE_EVENTS:
+            self.renderer.mark_dirty()
+            return True
+            
+        if event.type == pygame.KEYDOWN and event.key == FULLSCREEN_KEY:
+            self.toggle_fullscreen()
+            return True
             
+        if self.renderer.typing():
+            # the first click shows the rest of the page
+            if event.type == pygame.KEYDOWN and event.key in (pygame.K_SPACE, pygame.K_RETURN) \
+            or event.type == pygame.MOUSEBUTTONDOWN and event.button == CLICK_BUTTON:
+                self.renderer.complete_typing()
+                return True
+                
+        return False
+        
+        
     def check_event(self, event):
         if self.exit_event_check(event):
             self.running = False
             
         elif event.type == pygame.KEYDOWN:
             if event.key in (pygame.K_SPACE, pygame.K_RETURN):
-                self.waiting = False
-                self.skip_mode = False
+                self.click()
                 
             elif event.key == SKIP_KEY:
                 self.skip_mode = not self.skip_mode
                 
-            elif event.key == FULLSCREEN_KEY:
-                self.toggle_fullscreen()
-                
         elif event.type == pygame.MOUSEBUTTONDOWN:
             if event.button == CLICK_BUTTON:
-                self.waiting = False
-                self.skip_mode = False
+                self.click()
                 
                 
+    def click(self):
+        if self.is_click_wait():
+            self.resume()
+            
+        self.skip_mode = False
+        
+        
+    def wait_for(self, request):
+        super(TextlessInterpreter, self).wait_for(request)
+        
+        # while the player reads
+        self.prefetcher.scan()
+        
+        
+    def resume(self, answer=None):
+        branching = isinstance( self.wait_request, (onscr_interpreter.ChoiceWait,
+                                                    onscr_interpreter.ButtonWait) )
+        super(TextlessInterpreter, self).resume(answer)
+        
+        if branching:
+            # what was loaded for where the script didn't go isn't needed
+            self.prefetcher.cancel()
+        
+        
+    def is_click_wait(self):
+        return isinstance( self.wait_request, (onscr_interpreter.ClickWait,
+                                               onscr_interpreter.PageWait) )
+                                               
+                                               
     def exit_event_check(self, event):
         # returns True if the program should exit
         # and False otherwise
@@ -153,23 +1172,11 @@ class TextlessInterpreter(onscr_interpreter.VarKeeper):
         
         
     def update_view(self):
-        self.clock.tick(self.MAX_FPS)
-        
-        self.draw_everything()
-        pygame.display.update()
-        
-        
-    def draw_everything(self):
-        # background
-        self._surface.blit( self.bg, (0, 0) )
-        
-        # sprites
-        for topleft, img in self.sprites.itervalues():
-            self._surface.blit(img, topleft)
+        if self.threaded:
+            self.publish()
             
-        # standing pictures
-        for topleft, img in self.standing_pictures.itervalues():
-            self._surface.blit(img, topleft)
+        else:
+            self.renderer.update( self.take_scene() if self.dirty else None )
             
             
     def localize_path(self, path):
@@ -181,61 +1188,98 @@ class TextlessInterpreter(onscr_interpreter.VarKeeper):
         return path.lower()
         
         
-    def do_end(self):
-        self.running = False
-        
-        
     def do_play(self, name):
-        name = self.unstr(name)
         try:
-            tracknum = int(name[1:])
+            path = self.music_path(name)
             
         except ValueError:
-            self.error("Music track with name " + name + " not supported!")
+            self.error("Music track with name " + self.unstr(name) + " not supported!")
             return
             
+        if path != None:
+            load = lambda: pygame.mixer.music.load( self.files.open(path) )
+            self.audio.play(audio.MUSIC, path, load, -1)
+            
+            
+    def music_path(self, name):
+        # the file of a track, None if there's none;
+        # ValueError if the name isn't of a track
+        tracknum = int( self.unstr(name)[1:] )
+        
         namebase = "CD/Track{0:02}".format(tracknum)
         tracknames = [namebase+".mp3", namebase+".ogg"]
         
         for name in tracknames:
             #~ print("Try", name)
-            if os.path.exists(name):
+            if self.files.exists(name):
                 #~ print("Gotcha!")
-                pygame.mixer.music.load(name)
-                pygame.mixer.music.play(-1)
-                break
+                return name
+                
+        return None
                 
                 
     @onscr_interpreter.variable_loader
     def do_waveloop(self, path):
-        self.do_wavestop()
-        
-        path = self.localize_path(path)
-        self.wavesound = pygame.mixer.Sound(path)
-        self.wavesound.play(-1)
+        self.play_sound(0, path, -1)
         
         
     @onscr_interpreter.variable_loader
     def do_wave(self, path):
-        self.do_wavestop()
+        self.play_sound(0, path)
+        
+        
+    @onscr_interpreter.variable_loader
+    def do_dwaveloop(self, channel, path):
+        self.play_sound(channel, path, -1)
+        
+        
+    @onscr_interpreter.variable_loader
+    def do_dwave(self, channel, path):
+        self.play_sound(channel, path)
         
+        
+    def play_sound(self, channel, path, loops=0):
+        # what played on the channel is cut off
+        if not 0 <= channel < SOUND_CHANNELS:
+            self.error( "dwave to nonexistent channel " + str(channel) )
+            return
+            
         path = self.localize_path(path)
-        self.wavesound = pygame.mixer.Sound(path)
-        self.wavesound.play()
+        self.keep_sounds()
+        if path in self.sounds:
+            self.audio.play_now( channel, self.sounds[path], loops )
+            
+        else:
+            # the script goes on while it loads
+            self.audio.play( channel, path, self.prefetcher.claim("sounds", path), loops )
+            
+            
+    def keep_sounds(self):
+        # the ones the player loaded
+        for path, sound in self.audio.loaded():
+            self.sounds[path] = sound
+        
+        
+    def load_sound(self, path):
+        return pygame.mixer.Sound( self.files.open(path) )
         
         
     def do_stop(self):
-        self.do_playstop()
-        self.do_wavestop()
+        self.audio.stop_all()
         
         
     def do_playstop(self):
-        pygame.mixer.music.stop()
+        self.audio.stop(audio.MUSIC)
         
         
     def do_wavestop(self):
-        if self.wavesound != None:
-            self.wavesound.stop()
+        self.do_dwavestop(0)
+        
+        
+    @onscr_interpreter.variable_loader
+    def do_dwavestop(self, channel):
+        if 0 <= channel < SOUND_CHANNELS:
+            self.audio.stop(channel)
             
             
     @onscr_interpreter.variable_loader
@@ -249,31 +1293,41 @@ class TextlessInterpreter(onscr_interpreter.VarKeeper):
             self.error("Doing the ugly bg \"white\" hack due to a script error")
             something = b"#ffffff"
         
+        # a new surface, the last one might still be drawn
+        bg = pygame.Surface(self.resolution)
+        
         if self.is_color(something):
             color = self.colors[something]
-            self.bg.fill(color)
+            bg.fill(color)
             
         elif self.is_str(something):
             path = self.localize_path(something)
             
-            self.bg.blit(self.images[path], (0, 0))
+            bg.blit(self.images[path], (0, 0))
             
         else:
             self.error("This kind of BG is not supported currently: " + str(something) )
+            bg = self.bg
+            
+        self.bg = bg
         
         if len(args) > 0:
             self.error("bg with superfluous arguments")
             
+        self.scene_changed()
+            
     @onscr_interpreter.variable_loader
     def do_ld(self, pos, description, effect):
         if type(description) == int:
             self.error("ld int description... {0} {1} {2}".format(pos, description, effect))
             if description in self.sprites:
-                sprite = self.sprites[description]
+                sprite = self.sprites.get(description).image
+                name = self.sprites.get(description).name
             else:
                 return
         else:
             sprite = self.spritepool[description]
+            name = description
         pos = self.unstr(pos)
         
         # precalculate sprite positions
@@ -287,22 +1341,94 @@ class TextlessInterpreter(onscr_interpreter.VarKeeper):
         elif pos == "r":
             topleft[0] += mod
             
-        # add it
-        self.standing_pictures[pos] = (topleft, sprite)
+        # add it; standing pictures are sprites without a number
+        picture = sprites.Sprite( sprite, tuple(topleft), name=name )
+        self.pin_sprite(picture)
+        if pos in self.standing_pictures:
+            self.remove_sprite( self.standing_pictures[pos] )
+            
+        self.standing_pictures[pos] = picture
+        self.scene_changed(picture.rect)
         
         
     @onscr_interpreter.variable_loader
-    def lsp(self, spriteno, description, x, y, opacity=255):
-        if opacity != 255:
-            e = "Sprite transparency isn't supported yet"
-            info = "; called with {0} {1}".format(description, opacity)
-            self.error(e+info)
+    def do_lsp(self, spriteno, description, x, y, opacity=255):
+        if not 0 <= spriteno < self.sprites.size:
+            self.error( "lsp to nonexistent sprite slot " + str(spriteno) )
+            return
             
         # load sprite and add it
-        sprite = self.spritepool[description]
-        topleft = (x, y)
+        img = self.spritepool[description]
+        self.set_sprite( spriteno, sprites.Sprite(img, (x, y), alpha=opacity, name=description) )
+        
+        
+    def set_sprite(self, spriteno, sprite):
+        self.pin_sprite(sprite)
+        old = self.sprites.get(spriteno)
+        if old != None:
+            self.remove_sprite(old)
+            
+        self.sprites.set(spriteno, sprite)
+        self.scene_changed(sprite.rect)
+        
+        
+    def pin_sprite(self, sprite):
+        # what's on the screen stays in the pool
+        if sprite.name != None:
+            self.spritepool.pin(sprite.name)
+            
+            
+    def remove_sprite(self, sprite):
+        # a sprite or standing picture is taken off the screen
+        self.scene_changed(sprite.rect)
+        if sprite.name != None:
+            self.spritepool.unpin(sprite.name)
+        
+        
+    def get_sprite(self, cmd, spriteno):
+        if spriteno not in self.sprites:
+            self.error( "{0}'d nonexistent sprite {1}".format(cmd, spriteno) )
+            return None
+            
+        return self.sprites.get(spriteno)
+        
+        
+    @onscr_interpreter.variable_loader
+    def do_vsp(self, spriteno, visible):
+        if self.get_sprite("vsp", spriteno) != None:
+            self.change_sprite( spriteno, visible=(visible != 0) )
+            
+            
+    @onscr_interpreter.variable_loader
+    def do_msp(self, spriteno, x, y, alpha=0):
+        # relative movement
+        sprite = self.get_sprite("msp", spriteno)
+        if sprite != None:
+            old_x, old_y = sprite.topleft
+            self.change_sprite( spriteno, (old_x+x, old_y+y), alpha=sprite.alpha+alpha )
+            
+            
+    @onscr_interpreter.variable_loader
+    def do_amsp(self, spriteno, x, y, alpha=None):
+        if self.get_sprite("amsp", spriteno) != None:
+            self.change_sprite( spriteno, (x, y), alpha=alpha )
+            
+            
+    def change_sprite(self, spriteno, topleft=None, visible=None, alpha=None):
+        # sprites aren't changed in place but replaced
+        old = self.sprites.get(spriteno)
         
-        self.sprites[spriteno] = (topleft, sprite)
+        if topleft == None:
+            topleft = old.topleft
+            
+        if visible == None:
+            visible = old.visible
+            
+        if alpha == None:
+            alpha = old.alpha
+            
+        alpha = max( 0, min(alpha, 255) )
+        self.set_sprite( spriteno, sprites.Sprite(old.image, topleft, visible, alpha, old.name) )
         
         
     def load_sprite(self, description):
@@ -310,36 +1436,16 @@ class TextlessInterpreter(onscr_interpreter.VarKeeper):
         alpha, path = description.split(";")
         
         path = self.localize_path(path)
-        # we're not using self.images 'cause it shouldn't remember it
-        img = pygame.image.load(path)
         
         if alpha == ":c":
             # just the image; hurray
-            sprite = img
+            return self.sources.source(path)
             
         elif alpha == ":a":
-            # the right side of the image is an alpha mask
-            x, y = img.get_size()
-            img_x = x//2
-            
-            sprite_size = (img_x, y)
-            sprite = pygame.Surface(sprite_size, pygame.SRCALPHA)
-            sprite.blit( img, (0, 0) )
-            
-            alpha = pygame.surfarray.pixels_alpha(sprite)
-            
-            mask_area = pygame.Rect((img_x, 0), sprite_size)
-            mask = img.subsurface(mask_area)
-            mask_array = pygame.surfarray.array2d(mask)
-            
-            # set alpha to distance from (255, 255, 255)
-            white_surface = pygame.Surface( mask_area.size )
-            white_surface.fill( pygame.Color(b"#ffffff") )
-            full_white = pygame.surfarray.array2d(white_surface)
-            
-            alpha[:] = full_white-mask_array
-            
-            del alpha # otherwise we can't touch the sprite
+            # the right side of the image is an alpha mask; once
+            # it's composed it's kept on disk like the sources are
+            compose = lambda f: images.alpha_masked( self.sources.source(path) )
+            return self.pixels.load( self.files.open(path), alpha, compose )
             
         else:
             self.error("Unsupported image name: " + description)
@@ -349,18 +1455,32 @@ class TextlessInterpreter(onscr_interpreter.VarKeeper):
             return placeholder
             
             
-        return sprite
+    def sprite_path(self, description):
+        # the file a sprite is made from, None if it has none
+        parts = self.unstr(description).split(";")
+        return self.localize_path(parts[1]) if len(parts) == 2 else None
+        
+        
+    def load_image(self, path):
+        return self.sources.source(path)
+        
+        
+    def decode_source(self, path):
+        return self.pixels.load( self.files.open(path), "", images.load )
         
         
     @onscr_interpreter.variable_loader
     def do_cl(self, pos, effect = None, *args):
         pos = self.unstr(pos)
         if pos == "a":
+            for picture in self.standing_pictures.itervalues():
+                self.remove_sprite(picture)
+                
             self.standing_pictures = {}
             
         else:
             if pos in self.standing_pictures:
-                del self.standing_pictures[pos]
+                self.remove_sprite( self.standing_pictures.pop(pos) )
                 
             else:
                 self.error("!? Asked to delete nonexistent picture.")
@@ -371,26 +1491,28 @@ class TextlessInterpreter(onscr_interpreter.VarKeeper):
     @onscr_interpreter.variable_loader
     def do_csp(self, spriteno):
         if spriteno == -1:
-            self.sprites = {}
+            for sprite in self.sprites:
+                self.remove_sprite(sprite)
+                
+            self.sprites.clear()
             
-        else:
-            #~ del self.sprites[spriteno]
-            got = self.sprites.pop(spriteno, None)
-            if got == None:
-                self.error( "csp'd nonexistent sprite " + str(spriteno) )
+        elif self.get_sprite("csp", spriteno) != None:
+            self.remove_sprite( self.sprites.pop(spriteno) )
                 
                 
     def do_fileexist(self, var, path):
         # maybe we should also load this
         path = self.localize_path(path)
         
-        result = int( os.path.exists(path) )
+        result = int( self.files.exists(path) )
         self.error("fileexist result: " + str(result) )
         self.do_mov(var, result)
         
         
     def do_caption(self, s):
-        pygame.display.set_caption( self.unstr(s) + " (pynscr)" )
+        # the renderer sets it, it owns the window
+        self.caption = self.unstr(s) + " (pynscr)"
+        self.dirty = True
         
         
 class PygameInterpreter(TextlessInterpreter):
@@ -401,14 +1523,7 @@ class PygameInterpreter(TextlessInterpreter):
         super(PygameInterpreter, self).__init__(filename)
         
         # Font
-        if os.path.exists(DIR_FONT):
-            font_name = DIR_FONT
-            
-        else:
-            self.error( "No {0}. Falling back to pygame default font.".format(DIR_FONT) )
-            font_name = None # pygame default
-            
-        self.font = pygame.font.Font(font_name, FONT_SIZE)
+        self.font = pygame.font.Font(self.font_name, FONT_SIZE)
         
         # pixel positioning
         self.text_height = self.font.get_linesize()
@@ -417,6 +1532,7 @@ class PygameInterpreter(TextlessInterpreter):
         self.text_topleft = [border_width]*2
         txt_area_size = matrix.sub( self.resolution, matrix.mul(self.text_topleft, [2, 2]) )
         self.row_length = txt_area_size[0]
+        self.layout = layout.TextLayout(self.font, self.row_length)
         
         # text placing
         self.linenumber = 0
@@ -426,19 +1542,31 @@ class PygameInterpreter(TextlessInterpreter):
         
         self.text_states = []
         
+        # Every page gets a number of its own, so the renderer can tell
+        # them apart. It has page_chars characters, the first shown_chars
+        # of them aren't typed but shown at once.
+        self.pages_made = 0
+        self.page = 0
+        self.page_chars = 0
+        self.shown_chars = 0
+        self.text_speed = TEXT_SPEED
         
-        # setup
-        self.clearwait = False
+        
+        # choices and buttons currently waited on
+        self.choice_areas = []
         
         #~ # black filter
         #~ self.darkening = 0
         
-        # buttons
-        self.buttons = []
-        
         # menu
         self.rmenu = None
         
+        # backlog; backlog_page is None when it isn't shown,
+        # backlog_view is what the renderer is given for it
+        self.backlog = backlog.Backlog(self.parser, BACKLOG_SIZE)
+        self.backlog_page = None
+        self.backlog_view = None
+        
         # saving
         # normally this should be read in from the savenumber command
         self.savenumber = 20
@@ -446,46 +1574,119 @@ class PygameInterpreter(TextlessInterpreter):
         
         
     def check_event(self, event):
+        if self.check_backlog_event(event):
+            return
+            
+        request = self.wait_request
+        choosing = self.is_choice_wait()
+        if choosing:
+            self.answer_choice( request, self.area_choice(event, self.choice_areas) )
+            
         super(PygameInterpreter, self).check_event(event)
         
-        if event.type == pygame.MOUSEBUTTONDOWN:
+        if event.type == pygame.MOUSEBUTTONDOWN and not choosing:
             if event.button == RBUTTON:
                 self.open_rmenu()
                 
                 
-    def step(self):
-        if self.clearwait:
-            self.clear()
-            self.clearwait = False
+    def check_backlog_event(self, event):
+        # returns True if the event was used by the backlog
+        if self.exit_event_check(event):
+            return False
+            
+        older = newer = False
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            older = event.button == WHEEL_UP
+            newer = event.button == WHEEL_DOWN
+            
+        elif event.type == pygame.KEYDOWN and event.key in BACKLOG_KEYS:
+            older = event.key == BACKLOG_KEYS[0]
+            newer = event.key == BACKLOG_KEYS[1]
+            
+        if self.backlog_page == None:
+            # it can only be opened while reading
+            if older and self.is_click_wait() and len(self.backlog) > 0:
+                self.backlog_page = 0
+                self.mark_dirty()
+                return True
+                
+            return False
+            
+        if older:
+            self.backlog_page = min( self.backlog_page+1, len(self.backlog)-1 )
+            
+        elif newer and self.backlog_page > 0:
+            self.backlog_page -= 1
+            
+        elif newer or event.type in (pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN):
+            # scrolling past the last page or clicking closes it
+            self.backlog_page = None
+            
+        self.mark_dirty()
+        return True
         
-        super(PygameInterpreter, self).step()
         
+    def scene_fields(self):
+        fields = super(PygameInterpreter, self).scene_fields()
+        fields.update( text=tuple(self.text), page=self.page, page_chars=self.page_chars,
+                       shown_chars=self.shown_chars, text_speed=self.text_speed )
+                       
+        if self.backlog_page != None:
+            fields["backlog"] = self.backlog_scene()
+            
+        return fields
         
-    def draw_everything(self):
-        super(PygameInterpreter, self).draw_everything()
         
-        #~ if self.waiting and self.darkening < self.DARKENING_MAX:
-            #~ self.darkening += self.DARKENING_INC
-            #~ 
-        #~ # black filter behind text
-        #~ black = pygame.Surface(self.resolution)
-        #~ black.set_alpha(self.darkening)
-        #~ self._surface.blit( black, (0, 0) )
+    def backlog_scene(self):
+        # the serial of the page shown and its text, laid out like
+        # do_text and do_br would, without touching what's on the screen
+        serial = self.backlog.serial(self.backlog_page)
+        if self.backlog_view == None or self.backlog_view[0] != serial:
+            items = self.backlog.page_items(self.backlog_page)
+            pieces = self.layout.layout_page(items)[0]
+            words = tuple( (self.text_pos(line, x), s) for line, x, s in pieces )
+            self.backlog_view = (serial, words)
+            
+        return self.backlog_view
+        
         
+    def is_choice_wait(self):
+        return isinstance( self.wait_request, (onscr_interpreter.ChoiceWait,
+                                               onscr_interpreter.ButtonWait) )
+                                               
+                                               
+    def wait_for(self, request):
+        super(PygameInterpreter, self).wait_for(request)
         
-        # text display
-        for topleft, s in self.text:
-            text_size = self.font.size(s)
-            text_area = pygame.Rect(topleft, text_size)
+        if isinstance(request, onscr_interpreter.ChoiceWait):
+            self.skip_mode = False
+            self.choice_areas = self.menu_areas(request.choices)
+            
+        elif isinstance(request, onscr_interpreter.ButtonWait):
+            self.skip_mode = False
+            self.choice_areas = [ [pygame.Rect(topleft, size)] for num, topleft, size in request.buttons ]
             
-            # once in black, to outline it
-            outline_topleft = matrix.add(topleft, [1, 1])
-            text = self.font.render(s, True, self.colors[OUTLINE_COLOR])
-            self._surface.blit( text, outline_topleft )
             
-            # and once normally
-            text = self.font.render(s, True, self.colors[TEXT_COLOR])
-            self._surface.blit( text, topleft )
+    def answer_choice(self, request, result):
+        # result is what area_choice returned
+        if result == None:
+            return
+            
+        if isinstance(request, onscr_interpreter.ChoiceWait):
+            if result >= 0:
+                self.resume(result)
+                
+        elif result >= 0:
+            # the zeroth value is the num
+            self.resume( request.buttons[result][0] )
+            
+        elif result == -1:
+            # a click outside of every button
+            self.resume(0)
+            
+        else:
+            # right-click
+            self.resume(-1)
             
             
     @onscr_interpreter.variable_loader
@@ -493,7 +1694,7 @@ class PygameInterpreter(TextlessInterpreter):
         # definition of the right-click menu
         args = (self.unstr(a) for a in args)
         # (names, functionality)
-        self.rmenu = unpack_args(args)
+        self.rmenu = onscr_interpreter.unpack_args(args)
         
         
     def open_rmenu(self):
@@ -563,49 +1764,56 @@ class PygameInterpreter(TextlessInterpreter):
         
         
     def do_text(self, s):
-        if " " in s and s != " ":
-            for part in s.partition(" "):
-                if part == "":
-                    pass
-                    
-                else:
-                    self.do_text(part)
-                    
-        else:
-            # words and spaces
-            self.add_word(s)
+        self.backlog.add_text(s)
+        self.add_text(s)
+        
+        
+    def add_text(self, s):
+        self.page_chars += len(s)
+        
+        x = self.row_length-self.remaining_row
+        pieces, self.linenumber, x = self.layout.wrap(s, self.linenumber, x)
+        self.remaining_row = self.row_length-x
+        
+        # a piece per line
+        for line, x, piece in pieces:
+            self.text.append( (self.text_pos(line, x), piece) )
+            
+        # the renderer finds the new pieces itself
+        self.dirty = True
             
             
+    # what swapout_text puts away
+    TEXT_STATE = ("text", "linenumber", "remaining_row", "page", "page_chars", "text_speed")
+    
     def swapout_text(self):
         # This and swapin_text act like a stack
-        state = (self.text, self.linenumber, self.remaining_row)
+        state = [ getattr(self, name) for name in self.TEXT_STATE ]
         self.clear()
+        # our own menus aren't typed
+        self.text_speed = 0
         self.text_states.append(state)
         
         
     def swapin_text(self):
         self.clear()
         state = self.text_states.pop()
-        self.text, self.linenumber, self.remaining_row = state
+        for name, value in zip(self.TEXT_STATE, state):
+            setattr(self, name, value)
+            
+        # it was read already
+        self.shown_chars = self.page_chars
         
         
     def do_br(self):
         # a linefeed
+        self.backlog.add_br()
         self._next_line()
         
         
-    def add_word(self, s):
-        needed = self.font.size(s)[0]
-        
-        if needed > self.remaining_row:
-            self._next_line()
-            
-        topleft = self.get_pixelpos(self.linenumber, self.remaining_row)
-        topleft = matrix.add(topleft, self.text_topleft)
-        
-        self.text.append( (topleft, s) )
-        
-        self.remaining_row -= needed
+    def text_pos(self, line, x):
+        # the topleft of text on the screen
+        return matrix.add( (x, line*self.text_height), self.text_topleft )
         
         
     def _next_line(self):
@@ -620,37 +1828,23 @@ class PygameInterpreter(TextlessInterpreter):
         self.remaining_row = self.row_length
         
         self.text = []
+        self.pages_made += 1
+        self.page = self.pages_made
+        self.page_chars = 0
+        self.shown_chars = 0
+        self.dirty = True
         
         
-    def do_EOP(self):
-        self.waiting = True
-        self.clearwait = True
-        
-        
-    def do_select(self, *args):
-        self.do_goto( self.selection(args) )
+    def new_page(self):
+        self.backlog.end_page()
         self.clear()
         
         
-    def do_selgosub(self, *args):
-        self.do_gosub( self.selection(args) )
-        self.clear()
-        
-        
-    def selection(self, args):
-        texts, results = unpack_args(args)
-        
-        # User choice
-        got = self.text_menu(texts)
-        return results[got]
-        
-        
     def text_menu(self, choices, accept_rclick = False):
-        areas = []
-        for choice in choices:
-            self._next_line()
-            areas.append( self.render_text_with_area(choice) )
-            
+        # a blocking menu for our own menus; the script's
+        # choices are handled without blocking in check_event
+        areas = self.menu_areas(choices)
+        
         while True: # loop and a half
             result = self.button_choice(areas)
             # internally we count the choices from 0
@@ -660,11 +1854,20 @@ class PygameInterpreter(TextlessInterpreter):
         return result
         
         
+    def menu_areas(self, choices):
+        areas = []
+        for choice in choices:
+            self._next_line()
+            areas.append( self.render_text_with_area(choice) )
+            
+        return areas
+        
+        
     def render_text_with_area(self, text):
         before_linenumber = self.linenumber
         before_row = self.remaining_row
         
-        self.do_text(text)
+        self.add_text(text)
         
         return self.area_between_positions(before_linenumber, \
         before_row, self.linenumber, self.remaining_row)
@@ -722,18 +1925,6 @@ class PygameInterpreter(TextlessInterpreter):
         return (x, y)
         
         
-    def do_btndef(self, name):
-        # currently we don't do anything with the name
-        
-        del self.buttons[:]
-        
-        
-    def do_btn(self, num, x, y, w, h, xshift, yshift):
-        # Note: xshift and yshift are not implemented
-        
-        self.buttons.append( (num, (x, y), (w, h)) )
-        
-        
     def do_exbtn_d(self, s):
         pass
         
@@ -742,90 +1933,108 @@ class PygameInterpreter(TextlessInterpreter):
         pass
         
         
-    def do_btnwait(self, var, clear=True):
-        areas = [ [pygame.Rect(topleft, size)] for num, topleft, size in self.buttons ]
-        
-        result = self.button_choice(areas)
-        
-        # internally the choices are one less than the ones we return
-        if result >= 0:
-            # the user clicked on a button
-            result = self.buttons[result][0] # the zeroth value is the num
-            if clear:
-                del self.buttons[:]
-            
-        else:
-            # right-click or other exit
-            result += 1
-            
-        self.do_mov(var, result)
-        
-        
-    def do_btnwait2(self, var):
-        self.do_btnwait(var, clear=False)
-        
-        
     def button_choice(self, areas):
         # button mode
         self.skip_mode = False
-        areacount = len(areas)
         
         while True: # there's a return statement inside
-            for event in pygame.event.get():
+            self.update_view()
+            
+            for event in self.get_events():
                 if self.exit_event_check(event):
                     exit(0)
                     
-                elif event.type == pygame.KEYDOWN:
-                    # Hopefully pygame will keep the numbers of
-                    # K_0, K_1, ... K_9 sequential
-                    if pygame.K_1 <= event.key <= pygame.K_9:
-                        # player choices are indexed from 1,
-                        # but our area return values are indexed from 0
-                        i = event.key-pygame.K_1
-                        if i < areacount:
-                            return i
-                            
-                            
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    if event.button == CLICK_BUTTON:
-                        for i in xrange( areacount ):
-                            area = areas[i]
-                            pos = event.pos
-                            if is_in_area(area, pos):
-                                return i
-                                
-                        return -1
-                        
-                    elif event.button == RBUTTON:
-                        # internally we return -2 instead of -1 for right-clicking
-                        return -2
-                        
-            self.update_view()
+                result = self.area_choice(event, areas)
+                if result != None:
+                    return result
+                    
             
             
+    def area_choice(self, event, areas):
+        """Return the index of the area chosen by the event, -1 for a
+        click outside of every area, -2 for a right-click and None if
+        the event didn't choose anything."""
+        
+        if event.type == pygame.KEYDOWN:
+            # Hopefully pygame will keep the numbers of
+            # K_0, K_1, ... K_9 sequential
+            if pygame.K_1 <= event.key <= pygame.K_9:
+                # player choices are indexed from 1,
+                # but our area return values are indexed from 0
+                i = event.key-pygame.K_1
+                if i < len(areas):
+                    return i
+                    
+        elif event.type == pygame.MOUSEBUTTONDOWN:
+            if event.button == CLICK_BUTTON:
+                for i in xrange( len(areas) ):
+                    if is_in_area(areas[i], event.pos):
+                        return i
+                        
+                return -1
+                
+            elif event.button == RBUTTON:
+                # internally we return -2 instead of -1 for right-clicking
+                return -2
+                
+        return None
+        
+        
 class StandaloneInterpreter(PygameInterpreter):
     def __init__(self, resolution, filename):
         pygame.init()
         self.resolution = resolution
+        
+        super(StandaloneInterpreter, self).__init__(filename)
+        
         self.fullscreen_mode = True
         self.toggle_fullscreen()
         
-        super(StandaloneInterpreter, self).__init__(filename)
+        
+    def make_renderer(self):
+        if DISPLAY_BACKEND in ("texture", "software"):
+            try:
+                return TextureSceneRenderer( self.resolution, self.font_name,
+                                             software=(DISPLAY_BACKEND == "software") )
+                                             
+            except (ImportError, pygame.error) as e:
+                self.error( "No SDL renderer ({0}), drawing on the display surface.".format(e) )
+                
+        return super(StandaloneInterpreter, self).make_renderer()
         
         
     def toggle_fullscreen(self):
-        if self.fullscreen_mode:
+        if isinstance(self.renderer, TextureSceneRenderer):
+            self.fullscreen_mode = not self.fullscreen_mode
+            self.renderer.set_fullscreen(self.fullscreen_mode)
+            
+        elif self.fullscreen_mode:
             self.fullscreen_mode = False
-            self.set_surface( pygame.display.set_mode(self.resolution) )
+            self.set_surface( self.set_mode() )
             
         elif pygame.display.mode_ok(self.resolution, pygame.FULLSCREEN):
             self.fullscreen_mode = True
-            self.set_surface( pygame.display.set_mode(self.resolution, pygame.FULLSCREEN) )
+            self.set_surface( self.set_mode(pygame.FULLSCREEN) )
             
         else:
             self.error("Can't switch to fullscreen mode!")
             
             
+    def set_mode(self, flags=0):
+        if VSYNC:
+            try:
+                # pygame only does vsync with a renderer behind the window
+                surface = pygame.display.set_mode(self.resolution, flags | pygame.SCALED, vsync=1)
+                self.renderer.vsync = True
+                return surface
+                
+            except pygame.error:
+                self.error("No vsync, the clock will pace the frames.")
+                
+        self.renderer.vsync = False
+        return pygame.display.set_mode(self.resolution, flags)
+        
+        
 def is_in_area(area, pos):
     for rect in area:
         if rect.collidepoint(pos):
@@ -834,26 +2043,17 @@ def is_in_area(area, pos):
     return False
     
     
-def unpack_args(seq):
-    seq = list(seq)
-    a = []
-    b = []
-    for i in xrange( len(seq)//2 ):
-        a.append( seq[(i*2)] )
-        b.append( seq[i*2+1] )
-        
-    return a, b
-    
-    
 def main():
-    if len(sys.argv) == 2:
-        directory = sys.argv[1]
+    argv, profiler = profiling.parse_argv(sys.argv)
+    
+    if len(argv) == 2:
+        directory = argv[1]
         
-    elif len(sys.argv) == 1:
+    elif len(argv) == 1:
         directory = os.curdir
         
     else:
-        print("Usage: pynscr_pygame.py [DIRECTORY]")
+        print("Usage: pynscr_pygame.py [--profile[=FILE]] [DIRECTORY]")
         exit(1)
         
     if not os.path.exists(directory):
@@ -868,7 +2068,21 @@ def main():
         exit(3)
         
     interpreter = StandaloneInterpreter(RESOLUTION, SCRIPT_NAME)
-    interpreter.run()
+    if profiler != None:
+        profiler.attach(interpreter)
+        
+    try:
+        interpreter.run()
+        
+    finally:
+        interpreter.renderer.save_glyphs()
+        interpreter.prefetcher.close()
+        interpreter.audio.close()
+        if profiler != None:
+            profiler.caches.update( interpreter.cache_stats() )
+            profiler.prefetch = interpreter.prefetcher.stats()
+            profiler.audio = interpreter.audio.stats()
+            profiler.finish()
     
     
 if __name__ == '__main__':
@@ -30,6 +30,7 @@ from __future__ import division, print_function, unicode_literals
 import sys
 import curses
 
+import profiling
 import onscr_interpreter
 
 
@@ -50,20 +51,22 @@ class CursesInterpreter(onscr_interpreter.VarKeeper):
         if DEBUG:
             self.errorlog = []
             
-        self.running = False
-        self.clearwait = False
-        
-        
+            
     def run(self):
-        self.running = True
+        script = self.execute()
         try:
-            while self.running:
-                super(CursesInterpreter, self).run_until_wait()
-                self.user_wait()
-                if self.clearwait:
-                    self.clear()
-                    self.clearwait = False
+            request = next(script)
+            while True:
+                answer = self.answer(request)
+                if not self.running:
+                    break
                     
+                request = script.send(answer)
+                
+        except StopIteration:
+            # the script ended
+            pass
+            
         finally:
             if DEBUG:
                 with open(b"PYONS_DEBUGLOG", b"w") as f:
@@ -72,14 +75,23 @@ class CursesInterpreter(onscr_interpreter.VarKeeper):
                         f.write(b"\n")
                         
                         
+    def answer(self, request):
+        if isinstance(request, onscr_interpreter.ChoiceWait):
+            return self.selection(request.choices)
+            
+        elif isinstance(request, onscr_interpreter.ButtonWait):
+            return self.button_wait()
+            
+        else:
+            self.user_wait()
+            
+            
     def user_wait(self):
         key = self.stdscr.getch()
         if key == ord('q'):
             self.running = False
             
-        self.waiting = False
-        
-        
+            
     def error(self, s):
         if DEBUG:
             self.errorlog.append(s)
@@ -96,46 +108,23 @@ class CursesInterpreter(onscr_interpreter.VarKeeper):
         self.stdscr.refresh()
         
         
-    def do_EOP(self):
-        self.waiting = True
-        self.clearwait = True
-        
-        
-    def do_end(self):
-        self.running = False
-        
-        
     def do_br(self):
         # print an end-of-line
         self.stdscr.addstr("\n")
         self.stdscr.refresh()
         
         
-    def do_select(self, *args):
-        self.do_goto( self.selection(args) )
-        self.clear()
-        
-        
-    def do_selgosub(self, *args):
-        self.do_gosub( self.selection(args) )
-        self.clear()
-        
-        
-    def selection(self, args):
-        labels = []
-        for i in xrange( len(args)//2 ):
-            txt = args[(i*2)]
-            labels.append( args[(i*2)+1] )
-            
+    def selection(self, choices):
+        for i, txt in enumerate(choices):
             txt = "{0}: {1}\n".format(i+1, txt)
             self.spectext(txt)
             
         # User choice
-        got = self.get_choice( range( 1, len(labels)+1 ) )
-        return labels[got-1]
+        got = self.get_choice( range( 1, len(choices)+1 ) )
+        return got-1
         
         
-    def do_btnwait(self, var):
+    def button_wait(self):
         # We emulate it, and don't even care about button definitons
         self.spectext("Button wait mode. (Probably a menu.)\n")
         self.spectext("Input a number between 0 and 9 please.\n")
@@ -145,7 +134,7 @@ class CursesInterpreter(onscr_interpreter.VarKeeper):
         if n == 9:
             n = -1
             
-        self.do_mov(var, n)
+        return n
         
         
     def spectext(self, s):
@@ -179,15 +168,26 @@ class CursesInterpreter(onscr_interpreter.VarKeeper):
         #~ 
         #~ 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: pyonscr_curses.py FILENAME")
+    argv, profiler = profiling.parse_argv(sys.argv)
+    
+    if len(argv) != 2:
+        print("Usage: pyonscr_curses.py [--profile[=FILE]] FILENAME")
         exit(1)
         
-    curses.wrapper(run_interpreter, sys.argv[1])
-    
-    
-def run_interpreter(stdscr, filename):
+    try:
+        curses.wrapper(run_interpreter, argv[1], profiler)
+        
+    finally:
+        # after curses gave the terminal back
+        if profiler != None:
+            profiler.finish()
+            
+            
+def run_interpreter(stdscr, filename, profiler=None):
     interpreter = CursesInterpreter(stdscr, filename)
+    if profiler != None:
+        profiler.attach(interpreter)
+        
     interpreter.run()
     
     
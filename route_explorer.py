@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       route_explorer.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""Runs a script headless and follows every choice the player could make.
+
+Every branch point (select, selgosub, btnwait) snapshots the interpreter
+and the branches are handed out to a process pool. States that were
+already seen (same variables and same position) are not explored twice.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import sys
+import json
+import hashlib
+import optparse
+import multiprocessing
+
+import onscr_parse
+import onscr_interpreter
+
+
+# statements executed before a route is given up as an endless loop
+STEP_LIMIT = 200000
+
+
+class ExplorerInterpreter(onscr_interpreter.VarKeeper):
+    """Runs the script without any frontend. Instead of asking the
+    player, choices are collected in self.branches."""
+    
+    def __init__(self, filename):
+        super(ExplorerInterpreter, self).__init__(filename)
+        
+        self.running = True
+        self.reset_counters()
+        
+        
+    def reset_counters(self):
+        self.branches = None
+        self.branch_request = None
+        self.visited_lines = set()
+        self.labels = set()
+        self.unsupported = set()
+        self.text_count = 0
+        self.page_count = 0
+        
+        
+    def step(self):
+        before = self.parser.current_line
+        statement = self.parser.read_next()
+        
+        # multi-line statements are read in one go
+        current = self.parser.current_line
+        self.visited_lines.update( xrange(before+1, current+1) )
+        self.visited_lines.add(current)
+        
+        self.run_stmt(statement)
+        
+        
+    def run_stmt(self, statement):
+        if len(statement) == 1:
+            self.labels.add( statement[0].lower() )
+            
+        super(ExplorerInterpreter, self).run_stmt(statement)
+        
+        
+    def _run_cmd(self, cmd, args):
+        if not hasattr(self, 'do_' + cmd):
+            self.unsupported.add(cmd)
+            return
+            
+        super(ExplorerInterpreter, self)._run_cmd(cmd, args)
+        
+        
+    def error(self, s):
+        pass
+        
+        
+    def restore(self, state):
+        super(ExplorerInterpreter, self).restore(state)
+        self.running = True
+        
+        
+    def wait_for(self, request):
+        # Clicks and pages are answered right away, only
+        # choices and buttons stop the run as branch points.
+        if isinstance(request, onscr_interpreter.ChoiceWait):
+            self.branches = list( enumerate(request.choices) )
+            
+        elif isinstance(request, onscr_interpreter.ButtonWait):
+            # 0 is a click outside of every button, -1 is a right-click
+            nums = [ num for num, topleft, size in request.buttons ] + [0, -1]
+            self.branches = [ (n, "btn {0}".format(n)) for n in nums ]
+            
+        else:
+            if isinstance(request, onscr_interpreter.PageWait):
+                self.page_count += 1
+                
+            request.resume(None)
+            return
+            
+        self.branch_request = request
+        self.waiting = True
+        
+        
+    def do_text(self, s):
+        self.text_count += len(s)
+        
+        
+    def do_br(self):
+        pass
+        
+        
+def state_key(state):
+    """Hash of the variables and the position in the script."""
+    
+    def significant(d):
+        # defaultdicts remember every variable that was read
+        return sorted( (k, v) for k, v in d.items() if v not in (0, "") )
+        
+    parser = state["parser"]
+    key = ( parser["current_line"], parser["gosub_stack"],
+            repr(parser["cmds"]), parser["unfinished"],
+            significant(state["numeric_vars"]),
+            significant(state["char_vars"]),
+            sorted(state["numalias"].items()),
+            sorted(state["stralias"].items()),
+            state["buttons"] )
+            
+    return hashlib.sha1( repr(key).encode("utf-8") ).hexdigest()
+    
+    
+# Every worker process keeps a single interpreter and keeps
+# restoring snapshots into it, so the script is only read once.
+_interpreter = None
+_initial_state = None
+_step_limit = STEP_LIMIT
+
+
+def _init_worker(filename, step_limit):
+    global _interpreter, _initial_state, _step_limit
+    _interpreter = ExplorerInterpreter(filename)
+    _initial_state = _interpreter.snapshot()
+    _step_limit = step_limit
+    
+    
+def _explore(task):
+    """Run one route segment: from a state up to the next branch point,
+    the end of the script or the step limit."""
+    
+    state, path = task
+    interpreter = _interpreter
+    
+    if state is None:
+        state = _initial_state
+        
+    interpreter.restore(state)
+    interpreter.reset_counters()
+    interpreter.waiting = False
+    
+    outcome = "end"
+    try:
+        steps = 0
+        while interpreter.running and not interpreter.waiting:
+            interpreter.step()
+            steps += 1
+            if steps >= _step_limit:
+                outcome = "step limit"
+                break
+                
+    except IndexError:
+        outcome = "end of script"
+        
+    except Exception as e:
+        outcome = "error: {0}".format(e)
+        
+    children = []
+    if interpreter.branches == []:
+        outcome = "choice without options"
+        
+    elif interpreter.branches is not None:
+        outcome = "branch"
+        request = interpreter.branch_request
+        at_branch = interpreter.snapshot()
+        for i, (answer, description) in enumerate(interpreter.branches):
+            interpreter.restore(at_branch)
+            request.resume(answer)
+            child = interpreter.snapshot()
+            choice = "{0}:{1}".format(i+1, description)
+            children.append( (state_key(child), child, path + (choice,)) )
+            
+    return dict( path=path, outcome=outcome, children=children,
+                 visited_lines=interpreter.visited_lines,
+                 labels=interpreter.labels,
+                 unsupported=interpreter.unsupported,
+                 text_count=interpreter.text_count,
+                 page_count=interpreter.page_count )
+                 
+                 
+def explore(filename, processes=None, step_limit=STEP_LIMIT, max_states=None):
+    """Explore every route of the script and return a report dict."""
+    
+    workers = multiprocessing.Pool(processes, _init_worker, (filename, step_limit))
+    
+    seen = set()
+    visited_lines = set()
+    labels = set()
+    unsupported = set()
+    routes = []
+    # text counted so far on the way to each pending state
+    text_before = { (): (0, 0) }
+    
+    pending = [ (None, ()) ]
+    try:
+        while pending:
+            batch, pending = pending, []
+            for result in workers.imap_unordered(_explore, batch):
+                visited_lines |= result["visited_lines"]
+                labels |= result["labels"]
+                unsupported |= result["unsupported"]
+                
+                path = result["path"]
+                text, pages = text_before.pop(path)
+                text += result["text_count"]
+                pages += result["page_count"]
+                
+                if result["outcome"] != "branch":
+                    routes.append( dict(path=path, outcome=result["outcome"],
+                                        text=text, pages=pages) )
+                                        
+                for key, child, child_path in result["children"]:
+                    if key in seen:
+                        routes.append( dict(path=child_path, outcome="merged",
+                                            text=text, pages=pages) )
+                        continue
+                        
+                    if max_states is not None and len(seen) >= max_states:
+                        routes.append( dict(path=child_path, outcome="state limit",
+                                            text=text, pages=pages) )
+                        continue
+                        
+                    seen.add(key)
+                    text_before[child_path] = (text, pages)
+                    pending.append( (child, child_path) )
+                    
+    finally:
+        workers.terminate()
+        
+    return dict( routes=routes, states=len(seen),
+                 labels=sorted(labels),
+                 unreached=unreached_code(filename, visited_lines),
+                 unsupported=sorted(unsupported) )
+                 
+                 
+def unreached_code(filename, visited_lines):
+    """Return (first line, last line, label) ranges of code that was
+    never executed. Empty lines and comments don't count."""
+    
+    reader = onscr_parse.LineReader(filename)
+    
+    ranges = []
+    label = None
+    # (first line, label) of the range being collected
+    opened = None
+    for i, line in enumerate(reader._lines):
+        if line.startswith(b"*"):
+            # a range doesn't go on past a label, it's under one
+            if opened is not None:
+                ranges.append( (opened[0]+1, end+1, opened[1]) )
+                opened = None
+                
+            label = line.lower()
+            
+        is_code = line != "" and not line.startswith(b";")
+        if is_code and i not in visited_lines:
+            if opened is None:
+                opened = (i, label)
+            end = i
+            
+        elif is_code and opened is not None:
+            ranges.append( (opened[0]+1, end+1, opened[1]) )
+            opened = None
+            
+    if opened is not None:
+        ranges.append( (opened[0]+1, end+1, opened[1]) )
+        
+    return ranges
+    
+    
+def print_report(report, out=sys.stdout):
+    print("States explored:", report["states"], file=out)
+    print("Reachable labels ({0}):".format( len(report["labels"]) ), file=out)
+    for label in report["labels"]:
+        print("   ", label, file=out)
+        
+    print("Routes ({0}):".format( len(report["routes"]) ), file=out)
+    for route in report["routes"]:
+        path = " > ".join(route["path"]) or "(no choices)"
+        print("    {0}: {1} characters, {2} pages [{3}]".format(
+              path, route["text"], route["pages"], route["outcome"]), file=out)
+              
+    print("Unreached code:", file=out)
+    for first, last, label in report["unreached"]:
+        print("    lines {0}-{1} (under {2})".format(first, last, label), file=out)
+        
+    if report["unsupported"]:
+        print("Unsupported commands:", ", ".join(report["unsupported"]), file=out)
+        
+        
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] FILENAME")
+    parser.add_option("-j", "--processes", type="int", default=None,
+                      help="number of worker processes (default: CPU count)")
+    parser.add_option("--step-limit", type="int", default=STEP_LIMIT,
+                      help="statements per route segment before giving up")
+    parser.add_option("--max-states", type="int", default=None,
+                      help="stop branching after this many distinct states")
+    parser.add_option("--json", metavar="FILE",
+                      help="also write the report as JSON to FILE")
+    options, args = parser.parse_args()
+    
+    if len(args) != 1:
+        parser.print_usage()
+        exit(1)
+        
+    report = explore(args[0], options.processes, options.step_limit, options.max_states)
+    print_report(report)
+    
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=1)
+            
+            
+if __name__ == '__main__':
+    main()
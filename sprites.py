@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       sprites.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+"""The numbered sprite slots of lsp and csp."""
+
+from __future__ import division, print_function, unicode_literals
+
+import pygame
+
+
+class Sprite(object):
+    # name is what the image was loaded as, if anything
+    __slots__ = ("image", "topleft", "visible", "alpha", "name")
+    
+    def __init__(self, image, topleft, visible=True, alpha=255, name=None):
+        self.image = image
+        self.topleft = topleft
+        self.visible = visible
+        self.alpha = alpha
+        self.name = name
+        
+        
+    @property
+    def rect(self):
+        return pygame.Rect( self.topleft, self.image.get_size() )
+        
+        
+class SpriteTable(object):
+    """A fixed number of sprite slots. Like in NScripter, a sprite with
+    a lower number is drawn over the ones with higher numbers.
+    
+    Iterating gives the sprites in drawing order, from the bottom up.
+    The occupied slots are linked in that order, so nothing has to be
+    sorted when drawing, and lsp and csp don't move the others. Where a
+    new one goes in the links is found in a bitmap of the occupied
+    slots, which takes a few word sized steps for the 1000 slots."""
+    
+    def __init__(self, size=1000):
+        self.size = size
+        self._slots = [None]*size
+        # the occupied slot drawn after each occupied one (the next
+        # lower number), None after the last; and the first one
+        self._next = [None]*size
+        self._first = None
+        # bit n is set if slot n is occupied
+        self._occupied = 0
+        self._count = 0
+        
+        
+    def __len__(self):
+        return self._count
+        
+        
+    def __contains__(self, num):
+        return 0 <= num < self.size and self._slots[num] != None
+        
+        
+    def __iter__(self):
+        slots = self._slots
+        links = self._next
+        num = self._first
+        while num != None:
+            yield slots[num]
+            num = links[num]
+            
+            
+    def get(self, num):
+        return self._slots[num]
+        
+        
+    def set(self, num, sprite):
+        if self._slots[num] == None:
+            self._link(num)
+            
+        self._slots[num] = sprite
+        
+        
+    def _link(self, num):
+        below = self._occupied & ( (1 << num)-1 )
+        self._next[num] = below.bit_length()-1 if below else None
+        
+        above = self._above(num)
+        if above == None:
+            self._first = num
+            
+        else:
+            self._next[above] = num
+            
+        self._occupied |= 1 << num
+        self._count += 1
+        
+        
+    def _above(self, num):
+        # the occupied slot with the lowest number over num, or None
+        above = self._occupied >> (num+1)
+        return num + (above & -above).bit_length() if above else None
+        
+        
+    def pop(self, num):
+        """Empty a slot and return what was in it, or None."""
+        
+        sprite = self._slots[num]
+        if sprite != None:
+            self._slots[num] = None
+            
+            above = self._above(num)
+            if above == None:
+                self._first = self._next[num]
+                
+            else:
+                self._next[above] = self._next[num]
+                
+            self._next[num] = None
+            self._occupied &= ~(1 << num)
+            self._count -= 1
+            
+        return sprite
+        
+        
+    def clear(self):
+        num = self._first
+        while num != None:
+            following = self._next[num]
+            self._slots[num] = self._next[num] = None
+            num = following
+            
+        self._first = None
+        self._occupied = 0
+        self._count = 0
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       test_archive.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+
+"""Reading archives built by hand, entry by entry."""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import bz2
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+
+import archive
+
+
+def sar(entries):
+    # entries are (name, data) pairs
+    directory = b"".join( name.encode("cp932") + b"\0" + struct.pack(b">II", 0, 0)
+                          for name, data in entries )
+    return _archive( entries, lambda name, offset, data: name.encode("cp932") + b"\0" +
+                                                         struct.pack(b">II", offset, len(data)),
+                     len(directory) )
+                     
+                     
+def nsa(entries):
+    # entries are (name, compression, stored, original length)
+    directory = b"".join( name.encode("cp932") + b"\0" + struct.pack(b">BIII", 0, 0, 0, 0)
+                          for name, compression, data, length in entries )
+    
+    def describe(name, offset, data):
+        compression, length = described[name]
+        return name.encode("cp932") + b"\0" + struct.pack(b">BIII", compression, offset, len(data), length)
+        
+    described = dict( (name, (compression, length)) for name, compression, data, length in entries )
+    return _archive( [ (name, data) for name, compression, data, length in entries ],
+                     describe, len(directory) )
+                     
+                     
+def _archive(entries, describe, directory_size):
+    base = 6 + directory_size
+    directory = []
+    offset = 0
+    for name, data in entries:
+        directory.append( describe(name, offset, data) )
+        offset += len(data)
+        
+    return struct.pack(b">HI", len(entries), base) + b"".join(directory) + \
+           b"".join( data for name, data in entries )
+           
+           
+def ns2(entries):
+    directory = b"".join( b'"' + name.encode("cp932") + b'"' + struct.pack(b"<I", len(data))
+                          for name, data in entries )
+    return struct.pack( b"<I", 4+len(directory) ) + directory + \
+           b"".join( data for name, data in entries )
+           
+           
+def literal_lzss(data):
+    # every byte as it is: a 1 bit, then the byte
+    bits = "".join( "1{0:08b}".format(ord(c)) for c in data )
+    bits += "0" * ( -len(bits) % 8 )
+    return bytes( bytearray( int(bits[i:i+8], 2) for i in xrange(0, len(bits), 8) ) )
+    
+    
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.opened = []
+        
+        
+    def tearDown(self):
+        for opened in self.opened:
+            opened.close()
+            
+        shutil.rmtree(self.directory)
+        
+        
+    def write(self, name, data):
+        with open( os.path.join(self.directory, name), "wb" ) as f:
+            f.write(data)
+            
+        return os.path.join(self.directory, name)
+        
+        
+    def open(self, name, data):
+        opened = archive.Archive( self.write(name, data) )
+        self.opened.append(opened)
+        return opened
+        
+        
+    def test_sar(self):
+        opened = self.open( "arc.sar", sar([ ("IMG\\BG.png", b"background"),
+                                             ("empty.txt", b""),
+                                             ("画像\\a.png", b"picture") ]) )
+                                             
+        self.assertEqual( sorted(opened.entries), ["empty.txt", "img/bg.png", "画像/a.png"] )
+        self.assertEqual( opened.open("img/bg.png").read(), b"background" )
+        self.assertEqual( opened.open("empty.txt").read(), b"" )
+        self.assertEqual( opened.open("画像/a.png").read(), b"picture" )
+        
+        
+    def test_entry_file(self):
+        opened = self.open( "arc.sar", sar([ ("a", b"first"), ("b", b"hello") ]) )
+        
+        f = opened.open("b")
+        self.assertEqual( f.read(2), b"he" )
+        self.assertEqual( f.tell(), 2 )
+        self.assertEqual( f.read(), b"llo" )
+        self.assertEqual( f.read(), b"" )
+        
+        f.seek(-2, 2)
+        self.assertEqual( f.read(), b"lo" )
+        f.seek(100)
+        self.assertEqual( f.tell(), 5 )
+        self.assertEqual( bytes( f.view() ), b"hello" )
+        
+        
+    def test_nsa(self):
+        text = b"text, text and more text"
+        spb = struct.pack(b">HH", 1, 1) + b"\x0a\x14\x1e"
+        opened = self.open( "arc.nsa", nsa([ ("stored.txt", archive.NONE, text, len(text)),
+                                             ("lzss.txt", archive.LZSS, literal_lzss(text), len(text)),
+                                             ("sound.nbz", archive.NBZ,
+                                              struct.pack(b">I", len(text)) + bz2.compress(text), 0),
+                                             ("image.bmp", archive.SPB, spb, 0) ]) )
+                                             
+        for name in ("stored.txt", "lzss.txt", "sound.nbz"):
+            self.assertEqual( opened.decompressed_length(name), len(text) )
+            self.assertEqual( opened.open(name).read(), text )
+            
+        image = opened.open("image.bmp").read()
+        self.assertEqual( image[:2], b"BM" )
+        self.assertEqual( image[-4:], b"\x0a\x14\x1e\x00" )
+        
+        
+    def test_unknown_compression(self):
+        opened = self.open( "arc.nsa", nsa([ ("a", 3, b"????", 4) ]) )
+        self.assertRaises( IOError, opened.open("a").read )
+        
+        
+    def test_ns2(self):
+        opened = self.open( "00.ns2", ns2([ ("se\\a.wav", b"sound"), ("b.txt", b"text") ]) )
+        
+        self.assertEqual( sorted(opened.entries), ["b.txt", "se/a.wav"] )
+        self.assertEqual( opened.open("se/a.wav").read(), b"sound" )
+        self.assertEqual( opened.open("b.txt").read(), b"text" )
+        
+        
+    def test_set_order(self):
+        # later archives replace the entries of earlier ones
+        self.write( "arc.sar", sar([ ("a", b"sar"), ("b", b"sar"), ("c", b"sar"), ("d", b"sar") ]) )
+        self.write( "arc.nsa", nsa([ ("b", archive.NONE, b"nsa", 3), ("c", archive.NONE, b"nsa", 3) ]) )
+        self.write( "arc2.nsa", nsa([ ("c", archive.NONE, b"nsa2", 4) ]) )
+        self.write( "00.ns2", ns2([ ("d", b"ns2") ]) )
+        self.write( "other.nsa", nsa([ ("a", archive.NONE, b"other", 5) ]) )
+        
+        archives = archive.ArchiveSet(self.directory)
+        self.opened.append(archives)
+        
+        self.assertEqual( [ os.path.basename(a.path) for a in archives.archives ],
+                          ["arc.sar", "arc.nsa", "arc2.nsa", "00.ns2"] )
+        self.assertEqual( [ archives.open(name).read() for name in "abcd" ],
+                          [b"sar", b"nsa", b"nsa2", b"ns2"] )
+        self.assertTrue( "A" in archives )
+        self.assertFalse( "e" in archives )
+        
+        
+    def test_set_nbz_sounds(self):
+        sound = b"RIFF, really"
+        self.write( "arc.nsa", nsa([ ("se\\a.nbz", archive.NBZ,
+                                      struct.pack(b">I", len(sound)) + bz2.compress(sound), 0) ]) )
+                                      
+        archives = archive.ArchiveSet(self.directory, cache_bytes=1024)
+        self.opened.append(archives)
+        
+        self.assertTrue( "se\\a.wav" in archives )
+        self.assertEqual( archives.open("se\\a.wav").read(), sound )
+        self.assertEqual( archives.open("SE/A.WAV").read(), sound )
+        
+        stats = archives.stats()
+        self.assertEqual( (stats["hits"], stats["misses"]), (1, 1) )
+        
+        
+    def test_set_decompresses_once(self):
+        text = b"text"*1000
+        self.write( "arc.nsa", nsa([ ("a.txt", archive.LZSS, literal_lzss(text), len(text)) ]) )
+        
+        archives = archive.ArchiveSet(self.directory)
+        self.opened.append(archives)
+        
+        decompressed = []
+        decompress = archives.archives[0].decompress
+        archives.archives[0].decompress = lambda name: decompressed.append(name) or decompress(name)
+        
+        read = []
+        threads = [ threading.Thread( target=lambda: read.append( archives.open("a.txt").read() ) )
+                    for i in xrange(4) ]
+        for thread in threads:
+            thread.start()
+            
+        for thread in threads:
+            thread.join()
+            
+        self.assertEqual( read, [text]*4 )
+        self.assertEqual( decompressed, ["a.txt"] )
+        
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       test_compression.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+
+"""The archive decoders against ports of ONScripter's that go a bit at
+a time, and against entries made by hand."""
+
+from __future__ import division, print_function, unicode_literals
+
+import bz2
+import random
+import struct
+import unittest
+
+import compression
+
+
+class BitWriter(object):
+    def __init__(self):
+        self.bits = []
+        
+        
+    def put(self, value, width):
+        self.bits.extend( value >> (width-1-i) & 1 for i in xrange(width) )
+        
+        
+    def data(self):
+        bits = self.bits + [0]*( -len(self.bits) % 8 )
+        return bytes( bytearray( int( "".join(map(str, bits[i:i+8])), 2 )
+                                 for i in xrange(0, len(bits), 8) ) )
+                                 
+                                 
+class BitReader(object):
+    # the bits after the data are 0
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.position = 0
+        
+        
+    def get(self, width):
+        value = 0
+        for i in xrange(width):
+            byte = self.position >> 3
+            bit = self.data[byte] >> (7-(self.position & 7)) & 1 if byte < len(self.data) else 0
+            value = value << 1 | bit
+            self.position += 1
+            
+        return value
+        
+        
+def reference_lzss(data, length):
+    # ONScripter's decodeLZSS: Okumura's decoder with EI=8, EJ=4, P=1
+    reader = BitReader(data)
+    ring = [0]*256
+    r = 256-17
+    out = bytearray()
+    while len(out) < length and reader.position+9 <= len(data)*8:
+        if reader.get(1):
+            c = reader.get(8)
+            out.append(c)
+            ring[r] = c
+            r = (r+1) & 0xff
+            continue
+            
+        i = reader.get(8)
+        j = reader.get(4)
+        for k in xrange(j+2):
+            c = ring[(i+k) & 0xff]
+            out.append(c)
+            ring[r] = c
+            r = (r+1) & 0xff
+            
+    return out[:length]
+    
+    
+def reference_spb(data):
+    # ONScripter's decodeSPB, the pixels of the BMP rows
+    width, height = struct.unpack_from(b">HH", data)
+    reader = BitReader(data)
+    reader.position = 32
+    
+    row = (width*3+3) // 4 * 4
+    out = bytearray(row*height)
+    for channel in xrange(3):
+        c = reader.get(8)
+        values = [c]
+        while len(values) < width*height:
+            n = reader.get(3)
+            if n == 0:
+                values += [c]*4
+                continue
+                
+            m = reader.get(1)+1 if n == 7 else n+2
+            for i in xrange(4):
+                if m == 8:
+                    c = reader.get(8)
+                    
+                else:
+                    k = reader.get(m)
+                    c = (c + (k >> 1) + 1 if k & 1 else c - (k >> 1)) & 0xff
+                    
+                values.append(c)
+                
+        values = iter(values)
+        for y in xrange(height):
+            xs = xrange(width) if y % 2 == 0 else xrange(width-1, -1, -1)
+            for x in xs:
+                out[(height-1-y)*row + x*3 + channel] = next(values)
+                
+    return out
+    
+    
+def random_lzss(tokens, rng):
+    writer = BitWriter()
+    for i in xrange(tokens):
+        if rng.random() < 0.5:
+            writer.put(1, 1)
+            writer.put(rng.randrange(256), 8)
+            
+        else:
+            writer.put(0, 1)
+            writer.put(rng.randrange(256), 8)
+            writer.put(rng.randrange(16), 4)
+            
+    return writer.data()
+    
+    
+def random_spb(width, height, rng):
+    writer = BitWriter()
+    writer.put(width, 16)
+    writer.put(height, 16)
+    for channel in xrange(3):
+        writer.put(rng.randrange(256), 8)
+        for group in xrange( (width*height-1+3) // 4 ):
+            n = rng.randrange(8)
+            writer.put(n, 3)
+            if n == 0:
+                continue
+                
+            if n == 7:
+                m = rng.randrange(2)
+                writer.put(m, 1)
+                m += 1
+                
+            else:
+                m = n+2
+                
+            for i in xrange(4):
+                writer.put(rng.randrange(1 << m), m)
+                
+    return writer.data()
+    
+    
+class LZSSTest(unittest.TestCase):
+    def decode(self, data, length):
+        out = bytearray(length)
+        count = compression.decode_lzss(data, out)
+        return out[:count]
+        
+        
+    def test_copy_from_the_ring_start(self):
+        # "a" and "b" go to 239 and 240 of the ring, then 4 bytes
+        # are copied from 239
+        writer = BitWriter()
+        for c in b"ab":
+            writer.put(1, 1)
+            writer.put(ord(c), 8)
+            
+        writer.put(0, 1)
+        writer.put(239, 8)
+        writer.put(2, 4)
+        
+        self.assertEqual( self.decode(writer.data(), 6), bytearray(b"ababab") )
+        
+        
+    def test_copy_from_the_empty_ring(self):
+        writer = BitWriter()
+        writer.put(0, 1)
+        writer.put(0, 8)
+        writer.put(1, 4)
+        
+        self.assertEqual( self.decode(writer.data(), 3), bytearray(3) )
+        
+        
+    def test_matches_reference(self):
+        rng = random.Random(0)
+        for i in xrange(50):
+            data = random_lzss( rng.randrange(1, 400), rng )
+            length = rng.randrange(1, 2000)
+            self.assertEqual( self.decode(data, length), reference_lzss(data, length) )
+            
+            
+class SPBTest(unittest.TestCase):
+    def decode(self, data):
+        out = bytearray( compression.spb_size(data) )
+        size = compression.decode_spb(data, out)
+        self.assertEqual( size, len(out) )
+        return out
+        
+        
+    def test_header(self):
+        out = self.decode( random_spb(3, 2, random.Random(0)) )
+        magic, size = struct.unpack_from(b"<2sI", out)
+        width, height, planes, bits = struct.unpack_from(b"<iiHH", out, 18)
+        self.assertEqual( (magic, size, width, height, planes, bits), (b"BM", len(out), 3, 2, 1, 24) )
+        
+        
+    def test_single_pixel(self):
+        # blue, green and red are each just the first value
+        writer = BitWriter()
+        writer.put(1, 16)
+        writer.put(1, 16)
+        for value in (10, 20, 30):
+            writer.put(value, 8)
+            
+        out = self.decode( writer.data() )
+        self.assertEqual( out[compression.BMP_HEADER.size:], bytearray([10, 20, 30, 0]) )
+        
+        
+    def test_matches_reference(self):
+        rng = random.Random(0)
+        for i in xrange(50):
+            data = random_spb( rng.randrange(1, 30), rng.randrange(1, 30), rng )
+            out = self.decode(data)
+            self.assertEqual( out[compression.BMP_HEADER.size:], reference_spb(data) )
+            
+            
+class NBZTest(unittest.TestCase):
+    def test_known_entry(self):
+        original = b"".join( b"line {0}\n".format(i) for i in xrange(20000) )
+        data = struct.pack(b">I", len(original)) + bz2.compress(original)
+        
+        out = bytearray( compression.nbz_size(data) )
+        self.assertEqual( compression.decode_nbz(data, out), len(original) )
+        self.assertEqual( bytes(out), original )
+        
+        
+    def test_truncated(self):
+        rng = random.Random(0)
+        original = bytes( bytearray( rng.randrange(256) for i in xrange(10000) ) )
+        compressed = bz2.compress(original)
+        data = struct.pack(b">I", len(original)) + compressed[:len(compressed)//2]
+        
+        out = bytearray( compression.nbz_size(data) )
+        self.assertLess( compression.decode_nbz(data, out), len(original) )
+        
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       test_pixelcache.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+
+"""Keeping decoded images on disk."""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pygame
+
+import pixelcache
+
+
+class PixelCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = os.path.join(self.directory, "cache")
+        self.decoded = []
+        
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+        
+    def image(self, name, color):
+        path = os.path.join(self.directory, name)
+        surface = pygame.Surface( (4, 4), pygame.SRCALPHA )
+        surface.fill(color)
+        pygame.image.save(surface, path)
+        return path
+        
+        
+    def decode(self, path):
+        self.decoded.append(path)
+        return pygame.image.load(path)
+        
+        
+    def test_kept_between_runs(self):
+        path = self.image( "a.png", (10, 20, 30, 255) )
+        pixelcache.PixelCache(self.cache, 1 << 20).load(path, "", self.decode)
+        
+        cache = pixelcache.PixelCache(self.cache, 1 << 20)
+        surface = cache.load(path, "", self.decode)
+        self.assertEqual( tuple( surface.get_at((1, 1)) ), (10, 20, 30, 255) )
+        self.assertEqual( self.decoded, [path] )
+        self.assertEqual( cache.stats()["hits"], 1 )
+        
+        # decoded another way, it's another entry
+        cache.load(path, ":a", self.decode)
+        self.assertEqual( self.decoded, [path]*2 )
+        
+        
+    def test_without_directory(self):
+        path = self.image( "a.png", (10, 20, 30, 255) )
+        cache = pixelcache.PixelCache(None, 1 << 20)
+        cache.load(path, "", self.decode)
+        cache.load(path, "", self.decode)
+        
+        self.assertEqual( self.decoded, [path]*2 )
+        self.assertFalse( os.path.exists(self.cache) )
+        
+        
+    def test_evicts_least_recently_used(self):
+        # an entry is a header and 64 bytes of pixels
+        entry = pixelcache.HEADER.size + 4*4*4
+        cache = pixelcache.PixelCache(self.cache, 2*entry)
+        paths = [ self.image( "{0}.png".format(i), (i, i, i, 255) ) for i in xrange(3) ]
+        for path in paths:
+            cache.load(path, "", self.decode)
+            
+        self.assertEqual( cache.stats()["items"], 2 )
+        self.assertEqual( cache.stats()["evictions"], 1 )
+        self.assertEqual( len( os.listdir(self.cache) ), 2 )
+        
+        
+    def test_smaller_budget_next_run(self):
+        entry = pixelcache.HEADER.size + 4*4*4
+        cache = pixelcache.PixelCache(self.cache, 10*entry)
+        for i in xrange(3):
+            cache.load( self.image( "{0}.png".format(i), (i, i, i, 255) ), "", self.decode )
+            
+        cache = pixelcache.PixelCache(self.cache, entry)
+        self.assertEqual( cache.stats()["resident"], entry )
+        self.assertEqual( len( os.listdir(self.cache) ), 1 )
+        
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       test_pool.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+
+"""The pools: loading, the byte budget and pinning."""
+
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+import pool
+
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.loaded = []
+        self.dropped = []
+        # an item costs as much as its key says
+        self.pool = pool.Pool( self.load, budget=10, sizer=lambda value: value,
+                               dropped=lambda key, value: self.dropped.append(key) )
+                               
+                               
+    def load(self, key):
+        self.loaded.append(key)
+        return key
+        
+        
+    def test_loads_once(self):
+        self.assertEqual( self.pool[3], 3 )
+        self.assertEqual( self.pool[3], 3 )
+        self.assertEqual( self.loaded, [3] )
+        
+        stats = self.pool.stats()
+        self.assertEqual( (stats["hits"], stats["misses"], stats["resident"]), (1, 1, 3) )
+        
+        
+    def test_evicts_least_recently_used(self):
+        self.pool[4]
+        self.pool[3]
+        self.pool[4]
+        # 12 bytes; 3 was used longest ago
+        self.pool[5]
+        
+        self.assertEqual( sorted(self.pool), [4, 5] )
+        self.assertEqual( self.dropped, [3] )
+        self.assertEqual( self.pool.resident, 9 )
+        self.assertEqual( self.pool.stats()["evictions"], 1 )
+        
+        
+    def test_keeps_what_was_just_loaded(self):
+        self.pool[20]
+        self.assertEqual( list(self.pool), [20] )
+        
+        self.pool[1]
+        self.assertEqual( list(self.pool), [1] )
+        
+        
+    def test_pinned_stay(self):
+        self.pool[5]
+        self.pool.pin(5)
+        self.pool.pin(5)
+        self.pool[4]
+        self.pool[3]
+        
+        self.assertEqual( sorted(self.pool), [3, 5] )
+        
+        # over the budget until it's unpinned as many times
+        self.pool.pin(3)
+        self.pool[4]
+        self.assertEqual( self.pool.resident, 12 )
+        
+        self.pool.unpin(5)
+        self.assertTrue(5 in self.pool)
+        self.pool.unpin(5)
+        self.assertFalse(5 in self.pool)
+        self.assertEqual( self.pool.resident, 7 )
+        self.assertEqual( self.pool.stats()["pinned"], 1 )
+        
+        
+    def test_unpin_unpinned(self):
+        self.pool[5]
+        self.pool.unpin(5)
+        self.pool.unpin(6)
+        
+        self.pool.pin(5)
+        self.pool.unpin(5)
+        self.pool.unpin(5)
+        self.assertEqual( self.pool.stats()["pinned"], 0 )
+        
+        
+    def test_dropped(self):
+        self.pool[1]
+        self.pool[2]
+        del self.pool[1]
+        self.pool[2] = 2
+        self.pool.clear()
+        
+        self.assertEqual( self.dropped, [1, 2, 2] )
+        self.assertEqual( self.pool.resident, 0 )
+        
+        
+    def test_without_budget(self):
+        unbounded = pool.Pool( self.load, sizer=lambda value: value )
+        for key in xrange(10):
+            unbounded[key]
+            
+        self.assertEqual( len(unbounded), 10 )
+        self.assertEqual( unbounded.resident, 45 )
+        
+        
+class LRUPoolTest(unittest.TestCase):
+    def test_keeps_maxsize(self):
+        lru = pool.LRUPool(str, 2)
+        lru[1]
+        lru[2]
+        lru[1]
+        lru[3]
+        
+        self.assertEqual( sorted(lru.items()), [(1, "1"), (3, "3")] )
+        
+        
+class DynamicPoolTest(unittest.TestCase):
+    def test_loader_gets_the_pool(self):
+        def fibonacci(pool, n):
+            return n if n < 2 else pool(n-1) + pool(n-2)
+            
+        self.assertEqual( pool.DynamicPool(fibonacci)(30), 832040 )
+        
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       test_reload.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+
+"""Reloading an edited script: the lines and labels have to come out
+as if it was read anew, and the reading position has to follow."""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import onscr_parse
+
+
+SCRIPT = [ "*define", "game", "*start", "a", "b", "gosub *sub", "c",
+           "*middle", "d", "e", "end", "*sub", "f", "return" ]
+           
+           
+class ReloadTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "0.txt")
+        
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+        
+    def write(self, lines):
+        with open(self.path, "wb") as f:
+            f.write( "".join( line + "\n" for line in lines ).encode("sjis") )
+            
+            
+    def assertReadAnew(self, reader):
+        fresh = onscr_parse.LineReader(self.path)
+        self.assertEqual( reader._lines, fresh._lines )
+        self.assertEqual( reader._labels, fresh._labels )
+        self.assertEqual( reader.last_line, fresh.last_line )
+        
+        
+    def test_unchanged(self):
+        self.write(SCRIPT)
+        reader = onscr_parse.LineReader(self.path)
+        self.assertEqual( reader.reload(), (0, 0, 0) )
+        
+        
+    def test_follows_labels(self):
+        self.write(SCRIPT)
+        reader = onscr_parse.LineReader(self.path)
+        # at "e", inside a gosub from the line after "gosub *sub"
+        reader.goto("*middle")
+        reader.skip(3)
+        reader._gosub_stack = [ SCRIPT.index("gosub *sub") ]
+        
+        self.write( ["*define", "game", "new", "lines", "*start", "a", "b",
+                     "gosub *sub", "c", "more", "*middle", "d", "e", "end",
+                     "*sub", "f", "return"] )
+        # from the first change to the last
+        self.assertEqual( reader.reload(), (2, 5, 8) )
+        self.assertReadAnew(reader)
+        
+        self.assertEqual( reader.read_next(), "e" )
+        reader.cmd_return()
+        self.assertEqual( reader.read_next(), "c" )
+        
+        
+    def test_removed_label(self):
+        self.write(SCRIPT)
+        reader = onscr_parse.LineReader(self.path)
+        reader.goto("*middle")
+        reader.skip(2)
+        
+        lines = list(SCRIPT)
+        lines.remove("*middle")
+        self.write(lines)
+        reader.reload()
+        self.assertReadAnew(reader)
+        self.assertEqual( reader.label_line("*middle"), None )
+        
+        # before where the removed lines were
+        self.assertEqual( reader.read_next(), "d" )
+        
+        
+    def test_random_edits(self):
+        rng = random.Random(0)
+        words = ["*start", "*define", "*x", "*y", "text", "「日本語」", ""]
+        lines = list(SCRIPT)
+        self.write(lines)
+        reader = onscr_parse.LineReader(self.path)
+        
+        for i in xrange(200):
+            start = rng.randrange( len(lines)+1 )
+            end = min( start+rng.randrange(4), len(lines) )
+            lines[start:end] = [ rng.choice(words) for j in xrange( rng.randrange(4) ) ]
+            if "*define" not in lines:
+                lines.insert(0, "*define")
+                
+            self.write(lines)
+            reader.current_line = rng.randrange( -1, reader.last_line+1 )
+            reader.reload()
+            
+            self.assertReadAnew(reader)
+            self.assertTrue( -1 <= reader.current_line <= reader.last_line )
+            
+            
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       test_route_explorer.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+
+"""Finding the code no route reaches."""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import route_explorer
+
+
+class UnreachedCodeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "0.txt")
+        
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+        
+    def unreached(self, lines, visited):
+        with open(self.path, "wb") as f:
+            f.write( "".join( line + "\n" for line in lines ).encode("sjis") )
+            
+        return route_explorer.unreached_code(self.path, set(visited))
+        
+        
+    def test_everything_reached(self):
+        lines = ["*define", "game", "*start", "end"]
+        self.assertEqual( self.unreached(lines, xrange(4)), [] )
+        
+        
+    def test_split_at_labels(self):
+        lines = ["*define", "game", "*start", "end", "*one", "mov %0,1", "*two", "mov %0,2"]
+        self.assertEqual( self.unreached(lines, xrange(4)),
+                          [(5, 6, "*one"), (7, 8, "*two")] )
+                          
+                          
+    def test_under_the_label_it_starts_in(self):
+        lines = ["*define", "game", "*start", "mov %0,1", "mov %0,2", "; comment", "",
+                 "mov %0,3", "end"]
+        self.assertEqual( self.unreached(lines, [0, 1, 2, 3, 8]), [(5, 8, "*start")] )
+        
+        
+    def test_reached_code_ends_a_range(self):
+        lines = ["*define", "game", "*start", "mov %0,1", "mov %0,2", "mov %0,3", "end"]
+        self.assertEqual( self.unreached(lines, [0, 1, 2, 4, 6]),
+                          [(4, 4, "*start"), (6, 6, "*start")] )
+                          
+                          
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#       
+#       test_sprites.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#       
+#       
+
+
+"""The sprite slots, against a sorted list of the occupied ones."""
+
+from __future__ import division, print_function, unicode_literals
+
+import random
+import unittest
+
+import sprites
+
+
+class SpriteTableTest(unittest.TestCase):
+    def test_drawing_order(self):
+        table = sprites.SpriteTable(10)
+        for num in (3, 9, 0, 5):
+            table.set(num, "sprite {0}".format(num))
+            
+        # the highest number is drawn first
+        self.assertEqual( list(table), ["sprite 9", "sprite 5", "sprite 3", "sprite 0"] )
+        
+        table.set(5, "another")
+        self.assertEqual( list(table), ["sprite 9", "another", "sprite 3", "sprite 0"] )
+        self.assertEqual( len(table), 4 )
+        
+        
+    def test_pop(self):
+        table = sprites.SpriteTable(10)
+        table.set(4, "a")
+        
+        self.assertEqual( table.pop(7), None )
+        self.assertEqual( table.pop(4), "a" )
+        self.assertEqual( table.pop(4), None )
+        self.assertEqual( (list(table), len(table)), ([], 0) )
+        self.assertFalse(4 in table)
+        self.assertFalse(10 in table)
+        
+        
+    def test_random(self):
+        rng = random.Random(0)
+        table = sprites.SpriteTable(1000)
+        occupied = {}
+        for i in xrange(5000):
+            num = rng.randrange(1000)
+            action = rng.random()
+            if action < 0.5:
+                table.set(num, (num, i))
+                occupied[num] = (num, i)
+                
+            elif action < 0.99:
+                self.assertEqual( table.pop(num), occupied.pop(num, None) )
+                
+            else:
+                table.clear()
+                occupied.clear()
+                
+            if i % 50 == 0:
+                self.assertEqual( list(table), [ occupied[n] for n in sorted(occupied, reverse=True) ] )
+                self.assertEqual( len(table), len(occupied) )
+                
+                
+if __name__ == '__main__':
+    unittest.main()